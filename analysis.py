@@ -0,0 +1,125 @@
+import itertools
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# how every entity of the profile view is counted, filtered and ranked
+#   keys: columns an entity is grouped by
+#   sort_by: order of the table behind the chart
+#   min_percent: only entities on more than this percent of the movies
+#   min_count: only entities on at least this many movies
+#   weighted: weight the entity by its billing order within the movie
+#   features: standardized columns summed into the score
+ENTITY_RANKINGS = {
+    'director': {'keys': ['director', 'director_link'], 'sort_by': ['count', 'liked', 'rating'],
+                 'min_percent': None, 'min_count': 2, 'weighted': False, 'features': ['count', 'liked', 'rating']},
+    'actor': {'keys': ['actor', 'actor_link'], 'sort_by': ['count', 'liked', 'rating'],
+              'min_percent': None, 'min_count': 2, 'weighted': True, 'features': ['weights', 'liked_weighted', 'rating']},
+    'genre': {'keys': ['genre'], 'sort_by': ['count'],
+              'min_percent': 1, 'min_count': None, 'weighted': False, 'features': ['count', 'liked', 'rating']},
+    'theme': {'keys': ['theme'], 'sort_by': ['count', 'liked', 'rating'],
+              'min_percent': None, 'min_count': None, 'weighted': False, 'features': ['count', 'liked', 'rating']},
+}
+
+def billing_weights(df, key='id'):
+    """
+    weights the rows of every movie by their order on the page (cast billing, crew or theme order),
+    the first row gets 1 and each next one 1/n less
+    :param: df: rows grouped by movie, e.g. df_actor
+    :param: key: column identifying the movie
+    :rtype: returns a Series of weights aligned with df
+    """
+    grouped = df.groupby(key, sort=False)
+    return 1-grouped.cumcount()/grouped[key].transform('size')
+
+def genre_combinations(df_genre_merged, genres, size=2):
+    """
+    counts, likes and average ratings of the movies that have every genre of a combination,
+    for all combinations of the given genres at once
+    :param: df_genre_merged: one row per movie and genre, with the movie's rating and liked
+    :param: genres: genres to combine, the label of a combination keeps this order
+    :param: size: number of genres in a combination, 2 for pairs and 3 for triples
+    :rtype: returns df_genre_combination, one row per movie and combination it belongs to, and
+            df_temp_comb, the genre (combination label), liked, rating and count of each combination
+    """
+    df_genre = df_genre_merged[df_genre_merged['genre'].isin(genres)]
+    # factorize numbers the movies in order of first appearance, like drop_duplicates keeps them
+    codes, ids = pd.factorize(df_genre['id'])
+    df_movies = df_genre.drop_duplicates('id').drop(columns='genre').reset_index(drop=True)
+
+    # movie x genre indicator, then movie x combination indicator
+    indicator = np.zeros((len(ids), len(genres)), dtype=bool)
+    indicator[codes, pd.Index(genres).get_indexer(df_genre['genre'])] = True
+    combinations = np.array(list(itertools.combinations(range(len(genres)), size)), dtype=int).reshape(-1, size)
+    in_combination = np.logical_and.reduce([indicator[:, combinations[:, k]] for k in range(size)])
+    labels = np.array([" & ".join(genres[g] for g in combination) for combination in combinations], dtype=object)
+
+    # count, likes and rating sums of every combination in one product
+    values = np.column_stack([np.ones(len(ids)), df_movies['liked'], df_movies['rating']])
+    sums = in_combination.T.astype(float) @ values
+    found = sums[:, 0] > 0
+    df_temp_comb = pd.DataFrame({'genre': labels[found],
+                                 'liked': sums[found, 1].astype('int64'),
+                                 'rating': sums[found, 2]/sums[found, 0],
+                                 'count': sums[found, 0].astype('int64')})
+    df_temp_comb = df_temp_comb.sort_values('genre').reset_index(drop=True)
+    df_temp_comb = df_temp_comb.sort_values('count', ascending=False).reset_index(drop=True)
+
+    combination_idx, movie_idx = np.nonzero(in_combination.T)
+    df_genre_combination = df_movies.iloc[movie_idx].reset_index(drop=True)
+    df_genre_combination['genre'] = labels[combination_idx]
+    return df_genre_combination, df_temp_comb
+
+def zscore(values):
+    """
+    standardizes every column to zero mean and unit variance, like sklearn's StandardScaler
+    (population variance, constant columns are left at 0)
+    """
+    values = np.asarray(values, dtype=float)
+    std = values.std(axis=0)
+    std[std == 0] = 1
+    return (values-values.mean(axis=0))/std
+
+def rank_entities(df_temp, entity, features=['count', 'liked', 'rating']):
+    """
+    scores entities by the sum of their standardized features
+    :param: df_temp: one row per entity with the feature columns
+    :rtype: returns the entity, standardized features and score, sorted by score with the best first
+    """
+    df_weighted = pd.DataFrame(zscore(df_temp[features].values), columns=features)
+    df_weighted.insert(0, entity, df_temp[entity].values)
+    df_weighted['score'] = df_weighted[features].sum(axis=1)
+    return df_weighted.sort_values('score', ascending=False).reset_index(drop=True)
+
+def entity_table(df_merged, df_entity, entity, n_films):
+    """
+    counts, likes and average rating of every entity, see ENTITY_RANKINGS
+    :param: df_merged: the user's movies merged with df_entity
+    :param: df_entity: one row per movie and entity (df_director, df_actor, df_genre or df_theme)
+    :param: n_films: number of movies of the user
+    """
+    config = ENTITY_RANKINGS[entity]
+    df_count = df_entity[entity].value_counts().reset_index()
+    if config['min_percent'] is not None:
+        df_count = df_count[df_count['count']*100 > n_films*config['min_percent']].reset_index(drop=True)
+    df_temp = df_merged.groupby(config['keys'], observed=True).agg({'liked':'sum', 'rating':'mean'})
+    df_temp = pd.merge(df_temp.reset_index(), df_count, left_on=entity, right_on=entity)
+    if config['weighted']:
+        df_temp_w = df_entity.assign(weights=billing_weights(df_entity)).groupby(config['keys'], as_index=False, observed=True)['weights'].sum()
+        df_temp = pd.merge(df_temp, df_temp_w, left_on=config['keys'], right_on=config['keys'])
+    df_temp = df_temp.sort_values(config['sort_by'], ascending=False).reset_index(drop=True)
+    if config['min_count'] is not None:
+        df_temp = df_temp[df_temp['count'] >= config['min_count']]
+    if config['weighted']:
+        df_temp['liked_weighted'] = df_temp['liked'].astype(int)*df_temp['weights']
+    return df_temp
+
+@st.cache_data
+def profile_ranking(snapshot, entity, _df_merged, _df_entity, n_films):
+    """
+    entity_table and its ranking, computed once per user snapshot and entity
+    :param: snapshot: identifies the scraped data of the user, e.g. "<date>_<username>"
+    :rtype: returns the table of entity_table and the ranking of rank_entities
+    """
+    df_temp = entity_table(_df_merged, _df_entity, entity, n_films)
+    return df_temp, rank_entities(df_temp, entity, ENTITY_RANKINGS[entity]['features'])
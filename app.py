@@ -4,43 +4,50 @@ from htbuilder.units import rem
 import altair as alt
 import numpy as np
 import pandas as pd
-import pickle
-from deployment import scrape_films_details, scrape_films, scrape_friends, list_friends, recommend_movies, DOMAIN, classify_popularity, classify_likeability, classify_runtime
+from engine import score_recommendations, limit_friends, FriendsData, DOMAIN, classify_popularity, classify_likeability, classify_runtime
+from deployment import wait_for_job, show_partial_friends
+from analysis import genre_combinations, profile_ranking, rank_entities
+import result_store
+import run_log
+import cache_manager
+import jobs
 from pathlib import Path
 from datetime import date
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from sklearn.preprocessing import StandardScaler
-import os
 import datetime
 
 
-def delete_old_log_files(log_folder_path):
-    today = date.today()
-    today_str = str(today)
+@st.cache_resource
+def get_cache():
+    # once per process, the sweeper thread keeps the result store and the film store within their limits
+    return cache_manager.CacheManager()
 
-    for filename in os.listdir(log_folder_path):
-        filepath = os.path.join(log_folder_path, filename)
+@st.cache_resource
+def get_sheet():
+    # Create a connection object, once per process and only when a log is written
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+    credentials = service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"],
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+        ],
+    )
+    service = build('sheets', 'v4', credentials=credentials)
+    return service.spreadsheets()
 
-        # Make sure it's a file, not a subdirectory
-        if os.path.isfile(filepath):
-            # Split by '_' and compare the first part
-            if filename.split('_')[0] != today_str:
-                os.remove(filepath)
-                print(f"Deleted: {filename}")
+@st.cache_resource
+def get_run_log():
+    # the local database answers "already scraped today", the spreadsheet keeps the history
+    return run_log.RunLog([run_log.SQLiteBackend(), run_log.SheetsBackend(get_sheet, st.secrets['SAMPLE_SPREADSHEET_ID_input'])])
 
-delete_old_log_files('log')
-scaler = StandardScaler()
+@st.cache_resource
+def get_workers():
+    # once per process, the scraping runs in these processes rather than in the script thread of a session
+    return jobs.start_workers()
 
-# Create a connection object.
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"],
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-    ],
-)
-service = build('sheets', 'v4', credentials=credentials)
-sheet = service.spreadsheets()
+results = get_cache()
+runs = get_run_log()
+get_workers()
 
 if 'sidebar_state' not in st.session_state:
     st.session_state.sidebar_state = 'collapsed'
@@ -99,57 +106,46 @@ if selected_sect == sections[0]:
     row_button = st.columns((6,1,1,6))
     submit = row_button[1].button('Submit')
     reset = row_button[2].button('Reset')
-    result = False
 
+    # the submitted username is kept while the scraping job reruns the page
     if submit:
-        result = True
+        st.session_state.profile_query = username
 
     if reset:
-        result = False
+        st.session_state.pop('profile_query', None)
+        st.session_state.pop('profile_results', None)
+    result = 'profile_query' in st.session_state
     
     if result:
+        username = st.session_state.profile_query
         today = date.today()
-        filename = "{0}_{1}".format(str(today), username)
-        # df_log = pd.read_csv("log_detail.csv")
-        result_input = sheet.values().get(spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                            range='log_detail!A:AA').execute()
-        values_input = result_input.get('values', [])
-        df_log=pd.DataFrame(values_input[1:], columns=values_input[0])
-        df_found = df_log[(df_log['date'] == str(today)) & (df_log['username'] == username)].reset_index(drop=True)
-        if len(df_found) != 1:
-            # scraping process
-            df_film = scrape_films(username)
-            df_film = df_film[df_film['rating']!=-1].reset_index(drop=True)
-            st.write("You have {0} movies to scrape".format(len(df_film)))
-            df_rating, df_actor, df_director, df_genre, df_theme = scrape_films_details(df_film, username)
-
-            # export file
-            df_film.to_pickle('log/{0}_dff.pickle'.format(filename))
-            df_rating.to_pickle('log/{0}_dfr.pickle'.format(filename))
-            df_actor.to_pickle('log/{0}_dfa.pickle'.format(filename))
-            df_director.to_pickle('log/{0}_dfd.pickle'.format(filename))
-            df_genre.to_pickle('log/{0}_dfg.pickle'.format(filename))
-            df_theme.to_pickle('log/{0}_dft.pickle'.format(filename))
-            
-            # add new log
-            new_row = pd.DataFrame({'date':[str(today)], 'username':[username]})
-            df_log = pd.concat([df_log, new_row]).reset_index(drop=True)
-            response_date = service.spreadsheets().values().update(
-                spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                valueInputOption='RAW',
-                range='log_detail!A:AA',
-                body=dict(
-                    majorDimension='ROWS',
-                    values=df_log.T.reset_index().T.values.tolist())
-            ).execute()
-        else:
-            st.write("We already have scraped your data today")
-            df_film = pd.read_pickle('log/{0}_dff.pickle'.format(filename))
-            df_rating = pd.read_pickle('log/{0}_dfr.pickle'.format(filename))
-            df_actor = pd.read_pickle('log/{0}_dfa.pickle'.format(filename))
-            df_director = pd.read_pickle('log/{0}_dfd.pickle'.format(filename))
-            df_genre = pd.read_pickle('log/{0}_dfg.pickle'.format(filename))
-            df_theme = pd.read_pickle('log/{0}_dft.pickle'.format(filename))
+        filename = result_store.profile_snapshot(today, username)
+        # the frames are read once per snapshot, not on every rerun (e.g. ticking the research checkbox)
+        if st.session_state.get('profile_results', {}).get('query') != filename:
+            if not (runs.exists('log_detail', [str(today), username]) and results.lookup(filename)):
+                # scraping process, the frames are saved by the job
+                wait_for_job('profile', filename, {'username': username}, retry=submit)
+                results.add(filename, 'profile')
+                
+                # add new log
+                runs.record('log_detail', [str(today), username])
+            else:
+                st.write("We already have scraped your data today")
+            # only the columns the charts and texts below use
+            st.session_state.profile_results = {
+                'query': filename,
+                'df_film': result_store.load_frame(filename, 'film', columns=['id', 'title', 'rating', 'liked', 'link']),
+                'df_rating': result_store.load_frame(filename, 'rating', columns=['id', 'avg_rating', 'year', 'watched_by', 'liked_by', 'runtime', 'decade']),
+                'df_actor': result_store.load_frame(filename, 'actor', columns=['id', 'actor', 'actor_link']),
+                'df_director': result_store.load_frame(filename, 'director', columns=['id', 'director', 'director_link']),
+                'df_genre': result_store.load_frame(filename, 'genre', columns=['id', 'genre']),
+                'df_theme': result_store.load_frame(filename, 'theme', columns=['id', 'theme'])}
+        df_film = st.session_state.profile_results['df_film']
+        df_rating = st.session_state.profile_results['df_rating']
+        df_actor = st.session_state.profile_results['df_actor']
+        df_director = st.session_state.profile_results['df_director']
+        df_genre = st.session_state.profile_results['df_genre']
+        df_theme = st.session_state.profile_results['df_theme']
         
         st.write("---")
         st.markdown("<h1 style='text-align:center;'>👤 {0}'s Profile Analysis</h1>".format(username), unsafe_allow_html=True)
@@ -206,13 +202,11 @@ if selected_sect == sections[0]:
             )
         # data_temp = df_film['rating'].astype(str).value_counts().reset_index()
         # data_temp.rename(columns = {'index':'rating', 'rating':'count'}, inplace=True)
-        df_rating['runtime_group'] = df_rating.apply(lambda row:classify_runtime(row['runtime']), axis=1)
+        df_rating['runtime_group'] = classify_runtime(df_rating['runtime'])
         df_rating['ltw_ratio'] = df_rating['liked_by']/df_rating['watched_by']
-        df_rating['popularity'] = df_rating.apply(lambda row: classify_popularity(row['watched_by']), axis=1)
-        df_rating['likeability'] = df_rating.apply(lambda row: classify_likeability(row['ltw_ratio']), axis=1)
+        df_rating['popularity'] = classify_popularity(df_rating['watched_by'])
+        df_rating['likeability'] = classify_likeability(df_rating['ltw_ratio'])
         df_rating_merged = pd.merge(df_film, df_rating, left_on='id', right_on='id')
-        df_rating_merged['rating'] = df_rating_merged['rating'].astype(float)
-        df_rating_merged['avg_rating'] = df_rating_merged['avg_rating'].astype(float)
         df_rating_merged['difference'] = df_rating_merged['rating']-df_rating_merged['avg_rating']
         df_rating_merged['difference_abs'] = abs(df_rating_merged['difference'])
         
@@ -233,7 +227,7 @@ if selected_sect == sections[0]:
             st.markdown("""
             Looks like the average release date is around **{}**, with your oldest movie being **[{}]({})** ({}) and your latest being **[{}]({})** ({}).
             Your movies mostly were released in {}.
-            """.format(round(df_rating_merged['year'].astype(float).mean()),
+            """.format(round(df_rating_merged['year'].mean()),
                        df_rating_merged['title'].values[-1], DOMAIN+df_rating_merged['link'].values[-1], df_rating_merged['year'].values[-1],
                        df_rating_merged['title'].values[0], DOMAIN+df_rating_merged['link'].values[0], df_rating_merged['year'].values[0],
                        df_rating_merged['year'].value_counts().index[0]
@@ -306,8 +300,7 @@ if selected_sect == sections[0]:
             #     y='count',
             #     color=alt.Color(value="#00b020"),
             # ), theme=None, use_container_width=True)
-            df_film['rating'] = df_film['rating'].astype(str)
-            st.altair_chart(alt.Chart(df_film).mark_bar(tooltip=True).encode(
+            st.altair_chart(alt.Chart(df_film.assign(rating=df_film['rating'].astype(str))).mark_bar(tooltip=True).encode(
                 alt.X("rating", axis=alt.Axis(labelAngle=0)),
                 y='count()',
                 color=alt.Color('liked', scale=alt.Scale(domain=[True, False], range=["#ff8000", "#00b020"]))
@@ -457,24 +450,8 @@ if selected_sect == sections[0]:
         df_director_merged = pd.merge(df_film, df_director, left_on='id', right_on='id')
         df_actor_merged = pd.merge(df_film, df_actor, left_on='id', right_on='id')
 
-        df_temp = df_director['director'].value_counts().reset_index()
-        # df_temp.rename(columns = {'index':'director', 'director':'count'}, inplace=True)
-
-
-        df_director_merged['rating'] = df_director_merged['rating'].astype(float)
-        df_temp_2 = df_director_merged.groupby(['director', 'director_link']).agg({'liked':'sum', 'rating':'mean'})
-        df_temp_2 = df_temp_2.reset_index()
-
-        # st.dataframe(df_temp_2)
-        
-        df_temp = pd.merge(df_temp_2, df_temp, left_on='director', right_on='director')
-        df_temp = df_temp.sort_values(['count','liked','rating'], ascending=False).reset_index(drop=True)
-        df_temp = df_temp[df_temp['count']!=1]
-        scaled = scaler.fit_transform(df_temp[['count','liked','rating']].values)
-        df_weighted = pd.DataFrame(scaled, columns=['count','liked','rating'])
-        df_weighted = pd.merge(df_temp[['director']], df_weighted, left_index=True, right_index=True)
-        df_weighted['score'] = df_weighted['count']+df_weighted['liked']+df_weighted['rating']
-        df_temp = df_temp[df_temp['director'].isin(df_weighted.sort_values('score',ascending=False).head(20)['director'].tolist())]
+        df_temp, df_weighted = profile_ranking(filename, 'director', df_director_merged, df_director, df_film.shape[0])
+        df_temp = df_temp[df_temp['director'].isin(df_weighted.head(20)['director'].tolist())]
         # n_director = df_temp.iloc[14]['count']
         # df_temp = df_temp[df_temp['count']>=n_director]
         
@@ -553,41 +530,12 @@ if selected_sect == sections[0]:
             3. {}
             4. {}
             5. {}
-            """.format(
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[0,'director'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[1,'director'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[2,'director'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[3,'director'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[4,'director'],
-                       ))
-            # st.dataframe(df_weighted.sort_values('score',ascending=False).head())
+            """.format(*df_weighted['director'].head(5)))
+            # st.dataframe(df_weighted.head())
             
         
-        list_weights = []
-        movie_ids = df_actor['id'].unique()
-        for movie_id in movie_ids:
-            n_actor = df_actor.loc[df_actor['id']==movie_id].shape[0]
-            for i in range(n_actor):
-                weight = 1-i/n_actor
-                list_weights.append(weight)
-        df_actor['weights'] = list_weights
-        df_temp_w = df_actor.groupby(['actor', 'actor_link'],as_index=False)['weights'].sum()
-        df_temp = df_actor['actor'].value_counts().reset_index()
-        # df_temp.rename(columns = {'index':'actor', 'actor':'count'}, inplace=True)
-        df_actor_merged['rating'] = df_actor_merged['rating'].astype(float)
-        df_temp_2 = df_actor_merged.groupby(['actor', 'actor_link']).agg({'liked':'sum', 'rating':'mean'})
-        df_temp_2 = df_temp_2.reset_index()
-        df_temp = pd.merge(df_temp_2, df_temp, left_on='actor', right_on='actor')
-
-        df_temp = pd.merge(df_temp, df_temp_w, left_on=['actor','actor_link'], right_on=['actor','actor_link'])
-        df_temp = df_temp.sort_values(['count','liked','rating'], ascending=False).reset_index(drop=True)
-        df_temp = df_temp[df_temp['count']!=1]
-        df_temp['liked_weighted'] = df_temp['liked'].astype(int)*df_temp['weights']
-        scaled = scaler.fit_transform(df_temp[['weights','liked_weighted','rating']].values)
-        df_weighted = pd.DataFrame(scaled, columns=['weights','liked_weighted','rating'])
-        df_weighted = pd.merge(df_temp[['actor']], df_weighted, left_index=True, right_index=True)
-        df_weighted['score'] = df_weighted['weights']+df_weighted['liked_weighted']+df_weighted['rating']
-        df_temp = df_temp[df_temp['actor'].isin(df_weighted.sort_values('score',ascending=False).head(20)['actor'].tolist())]
+        df_temp, df_weighted = profile_ranking(filename, 'actor', df_actor_merged, df_actor, df_film.shape[0])
+        df_temp = df_temp[df_temp['actor'].isin(df_weighted.head(20)['actor'].tolist())]
         
 
         # n_actor = df_temp.iloc[19]['count']
@@ -650,55 +598,18 @@ if selected_sect == sections[0]:
             8. {}
             9. {}
             10. {}
-            """.format(
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[0,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[1,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[2,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[3,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[4,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[5,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[6,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[7,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[8,'actor'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[9,'actor']
-                       ))
+            """.format(*df_weighted['actor'].head(10)))
         st.write("")
         st.subheader("Genres Breakdown")
         row_genre = st.columns((2,1))
         df_genre_merged = pd.merge(df_film, df_genre, left_on='id', right_on='id')
-        df_temp = df_genre['genre'].value_counts().reset_index()
-        # df_temp.rename(columns = {'index':'genre', 'genre':'count'}, inplace=True)
-        df_temp = df_temp[df_temp['count'] > df_film.shape[0]/100].reset_index(drop=True)
-        df_genre_merged['rating'] = df_genre_merged['rating'].astype(float)
-        df_temp_2 = df_genre_merged.groupby(['genre']).agg({'liked':'sum', 'rating':'mean'})
-        df_temp_2 = df_temp_2.reset_index()
-        df_temp = pd.merge(df_temp_2, df_temp, left_on='genre', right_on='genre')
-        df_temp = df_temp.sort_values('count', ascending=False).reset_index(drop=True)
-        scaled = scaler.fit_transform(df_temp[['count','liked','rating']].values)
-        df_weighted = pd.DataFrame(scaled, columns=['count','liked','rating'])
-        df_weighted = pd.merge(df_temp[['genre']], df_weighted, left_index=True, right_index=True)
-        df_weighted['score'] = df_weighted['count']+df_weighted['liked']+df_weighted['rating']
+        df_temp, df_weighted = profile_ranking(filename, 'genre', df_genre_merged, df_genre, df_film.shape[0])
 
         if mbti_agree:
-            result_input = sheet.values().get(spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                            range='mbti!A:AA').execute()
-            values_input = result_input.get('values', [])
-            df_log_mbti=pd.DataFrame(values_input[1:], columns=values_input[0])
-            df_mbti_genre = df_weighted.copy()
-            df_mbti_genre = df_mbti_genre.sort_values('score',ascending=False).head()
-            df_mbti_genre['mbti'] = mbti
-            df_mbti_genre['username'] = username
-            df_mbti_genre = df_mbti_genre[['username', 'mbti', 'genre', 'score']]
-            df_log_mbti = pd.concat([df_log_mbti, df_mbti_genre]).reset_index(drop=True)
-            df_log_mbti.drop_duplicates(['username','mbti','genre'], inplace=True)
-            response_date = service.spreadsheets().values().update(
-                spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                valueInputOption='RAW',
-                range='mbti!A:AA',
-                body=dict(
-                    majorDimension='ROWS',
-                    values=df_log_mbti.T.reset_index().T.values.tolist())
-            ).execute()
+            # only the first answer of a user for a genre is kept
+            for genre, score in zip(df_weighted['genre'].head().tolist(), df_weighted['score'].head().tolist()):
+                if not runs.exists('mbti', [username, mbti, genre]):
+                    runs.record('mbti', [username, mbti, genre, score])
         
         with row_genre[0]:
             
@@ -762,39 +673,11 @@ if selected_sect == sections[0]:
             3. {}
             4. {}
             5. {}
-            """.format(
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[0,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[1,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[2,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[3,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[4,'genre'],
-                       ))
-        
+            """.format(*df_weighted['genre'].head(5)))
         
-        df_genre_combination = pd.DataFrame(columns=df_genre_merged.columns)
-        for i in range(len(df_temp['genre'].tolist())):
-            for j in range(i+1, len(df_temp['genre'].tolist())):
-                df_ha = df_genre_merged[(df_genre_merged['genre'] == df_temp['genre'].tolist()[i]) | (df_genre_merged['genre'] == df_temp['genre'].tolist()[j])]
-                if len(df_ha) != 0:
-                    df_ha['genre'] = df_temp['genre'].tolist()[i] + " & " + df_temp['genre'].tolist()[j]
-                    df_ha = df_ha[df_ha.duplicated('id')]
-                    df_genre_combination = pd.concat([df_genre_combination, df_ha]).reset_index(drop=True)
         
-        df_temp_comb = df_genre_combination['genre'].value_counts().reset_index()
-        # df_temp_comb.rename(columns = {'index':'genre', 'genre':'count'}, inplace=True)
-        df_genre_combination['rating'] = df_genre_combination['rating'].astype(float)
-        df_genre_combination['liked'] = df_genre_combination['liked'].astype(int)
-        df_temp_comb_2 = df_genre_combination.groupby(['genre']).agg({'liked':'sum', 'rating':'mean'})
-        df_genre_combination['liked'] = df_genre_combination['liked'].astype(bool)
-        df_temp_comb_2 = df_temp_comb_2.reset_index()
-    
-
-        df_temp_comb = pd.merge(df_temp_comb_2, df_temp_comb, left_on='genre', right_on='genre')
-        df_temp_comb = df_temp_comb.sort_values('count', ascending=False).reset_index(drop=True)
-        scaled = scaler.fit_transform(df_temp_comb[['count','liked','rating']].values)
-        df_weighted = pd.DataFrame(scaled, columns=['count','liked','rating'])
-        df_weighted = pd.merge(df_temp_comb[['genre']], df_weighted, left_index=True, right_index=True)
-        df_weighted['score'] = df_weighted['count']+df_weighted['liked']+df_weighted['rating']
+        df_genre_combination, df_temp_comb = genre_combinations(df_genre_merged, df_temp['genre'].tolist())
+        df_weighted = rank_entities(df_temp_comb, 'genre')
         n_genre = df_temp_comb.iloc[19]['count']
         df_temp_comb = df_temp_comb[df_temp_comb['count']>=n_genre]
 
@@ -869,51 +752,20 @@ if selected_sect == sections[0]:
             3. {}
             4. {}
             5. {}
-            """.format(
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[0,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[1,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[2,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[3,'genre'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[4,'genre'],
-                       ))
+            """.format(*df_weighted['genre'].head(5)))
         # st.dataframe(df_rating_merged)
 
         df_theme_merged = pd.merge(df_film, df_theme, left_on='id', right_on='id')
 
-        df_temp = df_theme['theme'].value_counts().reset_index()
-        # df_temp.rename(columns = {'index':'theme', 'theme':'count'}, inplace=True)
-        df_theme_merged['rating'] = df_theme_merged['rating'].astype(float)
-        df_temp_2 = df_theme_merged.groupby(['theme']).agg({'liked':'sum', 'rating':'mean'})
-        df_temp_2 = df_temp_2.reset_index()
-        df_temp = pd.merge(df_temp_2, df_temp, left_on='theme', right_on='theme')
-        df_temp = df_temp.sort_values(['count','liked','rating'], ascending=False).reset_index(drop=True)
-        scaled = scaler.fit_transform(df_temp[['count','liked','rating']].values)
-        df_weighted = pd.DataFrame(scaled, columns=['count','liked','rating'])
-        df_weighted = pd.merge(df_temp[['theme']], df_weighted, left_index=True, right_index=True)
-        df_weighted['score'] = df_weighted['count']+df_weighted['liked']+df_weighted['rating']
+        df_temp, df_weighted = profile_ranking(filename, 'theme', df_theme_merged, df_theme, df_film.shape[0])
         n_theme = df_temp.iloc[19]['count']
         df_temp = df_temp[df_temp['count']>=n_theme]
 
         if mbti_agree:
-            result_input = sheet.values().get(spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                            range='mbti_theme!A:AA').execute()
-            values_input = result_input.get('values', [])
-            df_log_mbti=pd.DataFrame(values_input[1:], columns=values_input[0])
-            df_mbti_theme = df_weighted.copy()
-            df_mbti_theme = df_mbti_theme.sort_values('score',ascending=False).head()
-            df_mbti_theme['mbti'] = mbti
-            df_mbti_theme['username'] = username
-            df_mbti_theme = df_mbti_theme[['username', 'mbti', 'theme', 'score']]
-            df_log_mbti = pd.concat([df_log_mbti, df_mbti_theme]).reset_index(drop=True)
-            df_log_mbti.drop_duplicates(['username','mbti','theme'], inplace=True)
-            response_date = service.spreadsheets().values().update(
-                spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                valueInputOption='RAW',
-                range='mbti_theme!A:AA',
-                body=dict(
-                    majorDimension='ROWS',
-                    values=df_log_mbti.T.reset_index().T.values.tolist())
-            ).execute()
+            # only the first answer of a user for a theme is kept
+            for theme, score in zip(df_weighted['theme'].head().tolist(), df_weighted['score'].head().tolist()):
+                if not runs.exists('mbti_theme', [username, mbti, theme]):
+                    runs.record('mbti_theme', [username, mbti, theme, score])
         
         # df_temp = df_temp[df_temp['count']!=1]
         st.write("")
@@ -964,14 +816,8 @@ if selected_sect == sections[0]:
             3. {}
             4. {}
             5. {}
-            """.format(
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[0,'theme'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[1,'theme'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[2,'theme'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[3,'theme'],
-                df_weighted.sort_values('score',ascending=False).reset_index(drop=True).loc[4,'theme']
-                       ))
-            # st.dataframe(df_weighted.sort_values('score',ascending=False).head())
+            """.format(*df_weighted['theme'].head(5)))
+            # st.dataframe(df_weighted.head())
         
             
 # elif selected_sect == sections[1]:
@@ -1008,74 +854,57 @@ elif selected_sect == sections[1]:
     row_button = st.columns((6,1,1,6))
     submit = row_button[1].button('Submit')
     reset = row_button[2].button('Reset')
-    result = False
 
+    # the submitted query is kept so that reruns (e.g. moving the weight sliders) keep the results,
+    # the limit only filters the scores of all the friends so it is read from the slider on every rerun
     if submit:
-        result = True
+        st.session_state.friends_query = (username, ftype)
 
     if reset:
-        result = False
+        st.session_state.pop('friends_query', None)
+        st.session_state.pop('friends_results', None)
+        st.session_state.pop('ranking_results', None)
+        st.session_state.pop('recom_results', None)
+    result = 'friends_query' in st.session_state
 
     if result:
+        username, ftype = st.session_state.friends_query
         today = date.today()
-        filename = "{0}_{1}_{2}_{3}".format(str(today), username, ftype, str(limit))
-        # df_log = pd.read_csv("log.csv")
-        result_input = sheet.values().get(spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                            range='log!A:AA').execute()
-        values_input = result_input.get('values', [])
-        df_log=pd.DataFrame(values_input[1:], columns=values_input[0])
-        df_found = df_log[(df_log['date'].str.contains(str(today))) & (df_log['username'].str.contains(username))
-                          & (df_log['ftype'].str.contains(ftype)) & (df_log['limit'] == str(limit))].reset_index(drop=True)
-        
-        if len(df_found) != 1:
-            # scraping process
-            friends_list = list_friends(username, ftype)
-            st.write("You have {0} friends to scrape".format(len(friends_list)))
-            df_friends, friends_data, df_a = scrape_friends(username, friends_list, limit)
-            df_friends = df_friends.sort_values('total_index', ascending=False).reset_index(drop=True)
+        filename = result_store.friends_snapshot(today, username, ftype)
+        if st.session_state.get('friends_results', {}).get('query') != st.session_state.friends_query:
+            if not results.lookup(filename):
+                # scraping process, the frames are saved by the job
+                wait_for_job('friends', filename, {'username': username, 'ftype': ftype}, retry=submit,
+                             show_partial=lambda rows: show_partial_friends(rows, limit))
+                results.add(filename, 'friends')
+            else:
+                st.write("We already have scraped your data today")
+            df_a = result_store.load_frame(filename, 'films_a', columns=['id', 'title', 'rating', 'liked', 'link'])
+            # the comparison frames take the titles and links from the user's movies, the friends' are only read by the recommendations job
+            df_friends_films = result_store.load_frame(filename, 'friends_films', columns=['username', 'id', 'rating', 'liked'])
+            st.session_state.friends_results = {'query': st.session_state.friends_query,
+                                                'friends_list': result_store.load_frame(filename, 'friends_list', columns=['username'])['username'].tolist(),
+                                                'df_scores': result_store.load_frame(filename, 'friends', columns=['username', 'index_score', 'no_of_movies', 'total_index']),
+                                                'friends_films': FriendsData.from_frame(username, df_a, df_friends_films).friends_films,
+                                                'df_a': df_a,
+                                                'errors': result_store.load_frame(filename, 'errors', columns=['url', 'status_code'])}
+        friends_list = st.session_state.friends_results['friends_list']
+        # the friends whose profile couldn't be scraped are left out of the ranking
+        for url, status_code in st.session_state.friends_results['errors'].itertuples(index=False):
+            st.warning("Couldn't scrape {} ({})".format(url, 'no response' if pd.isna(status_code) else 'status {}'.format(int(status_code))))
 
-            # export file
-            df_friends.to_pickle('log/{0}_dff.pickle'.format(filename))
-            df_a.to_pickle('log/{0}_dfa.pickle'.format(filename))
-            df_recom = recommend_movies(df_friends, friends_data, df_a)
-            df_recom = df_recom.sort_values('index', ascending=False).reset_index(drop=True)
-            df_recom = df_recom[df_recom['no_of_rate'] > 1].reset_index(drop=True)
-            df_recom = df_recom.iloc[:100]
-            
-            df_rating_recom, df_actor_recom, df_director_recom, df_genre_recom, df_theme_recom = scrape_films_details(df_recom, username)
-            df_recom = pd.merge(pd.merge(df_recom, df_rating_recom, left_on='id', right_on='id'), df_genre_recom, left_on='id', right_on='id')
-            df_recom['genre'] = df_recom.groupby(['id'])['genre'].transform(lambda x: '|'.join(x))
-            df_recom = df_recom.drop_duplicates().reset_index(drop=True)
-            df_recom['ltw_ratio'] = df_recom['liked_by']/df_recom['watched_by']
-            df_recom.to_pickle('log/{0}_dfr.pickle'.format(filename))
-            with open('log/{0}_fdd.pickle'.format(filename), 'wb') as f:
-                pickle.dump(friends_data, f)
-            with open('log/{0}_fl.pickle'.format(filename), 'wb') as f:
-                pickle.dump(friends_list, f)
-            
-            # add new log
-            new_row = pd.DataFrame({'date':[str(today)], 'username':[username], 'ftype':[ftype], 'limit':[limit]})
-            df_log = pd.concat([df_log, new_row]).reset_index(drop=True)
-            response_date = service.spreadsheets().values().update(
-                spreadsheetId=st.secrets['SAMPLE_SPREADSHEET_ID_input'],
-                valueInputOption='RAW',
-                range='log!A:AA',
-                body=dict(
-                    majorDimension='ROWS',
-                    values=df_log.T.reset_index().T.values.tolist())
-            ).execute()
-            # df_log.to_csv('log.csv', index=False)
-        else:
-            st.write("We already have scraped your data today")
-            with open('log/{0}_fl.pickle'.format(filename), 'rb') as f:
-                friends_list = pickle.load(f)
-            df_a = pd.read_pickle('log/{0}_dfa.pickle'.format(filename))
-            df_friends = pd.read_pickle('log/{0}_dff.pickle'.format(filename))
+        query = (username, ftype, limit)
+        if st.session_state.get('ranking_results', {}).get('query') != query:
+            df_friends, friends_data, df_a = limit_friends(username, st.session_state.friends_results['df_scores'],
+                                                           st.session_state.friends_results['friends_films'],
+                                                           st.session_state.friends_results['df_a'], limit)
             df_friends = df_friends.sort_values('total_index', ascending=False).reset_index(drop=True)
-            df_recom = pd.read_pickle('log/{0}_dfr.pickle'.format(filename))
-            df_recom['ltw_ratio'] = df_recom['liked_by']/df_recom['watched_by']
-            with open('log/{0}_fdd.pickle'.format(filename), 'rb') as f:
-                friends_data = pickle.load(f)
+            st.session_state.ranking_results = {'query': query, 'df_friends': df_friends, 'friends_data': friends_data}
+        df_friends = st.session_state.ranking_results['df_friends']
+        friends_data = st.session_state.ranking_results['friends_data']
+        if len(df_friends) == 0:
+            st.warning("None of your {} friends has rated at least {} of your movies".format(len(friends_list), limit))
+            st.stop()
 
         st.write("---")
         if (len(df_friends) <= 5):
@@ -1132,7 +961,36 @@ elif selected_sect == sections[1]:
         
         st.write("---")
         # Recommendation
-        
+        recom_filename = result_store.recommendations_snapshot(today, username, ftype, limit)
+        if st.session_state.get('recom_results', {}).get('query') != query:
+            if not (runs.exists('log', [str(today), username, ftype, limit]) and results.lookup(recom_filename)):
+                # the friends are already scored, only the recommended movies that aren't in the film store are scraped
+                wait_for_job('recommendations', recom_filename, {'username': username, 'friends': filename, 'limit': limit}, retry=submit)
+                results.add(recom_filename, 'recommendations')
+
+                # add new log
+                runs.record('log', [str(today), username, ftype, limit])
+            st.session_state.recom_results = {'query': query,
+                                              'df_recom_agg': result_store.load_frame(recom_filename, 'recom_agg',
+                                                                                      columns=['id', 'title', 'link', 'rating', 'liked', 'friends_score', 'no_of_rate']),
+                                              'df_recom_details': result_store.load_frame(recom_filename, 'recom_details',
+                                                                                          columns=['id', 'avg_rating', 'year', 'watched_by', 'liked_by', 'runtime', 'decade', 'genre'])}
+        df_recom_agg = st.session_state.recom_results['df_recom_agg']
+        df_recom_details = st.session_state.recom_results['df_recom_details']
+
+        with st.expander("⚖️ Tune Your Recommendations"):
+            row_weights = st.columns(4)
+            r_w = row_weights[0].slider("Friends' Ratings", 0.0, 10.0, 6.0, 0.5)
+            l_w = row_weights[1].slider("Friends' Likes", 0.0, 10.0, 3.0, 0.5)
+            fs_w = row_weights[2].slider("Friends' Scores", 0.0, 10.0, 2.0, 0.5)
+            nor_w = row_weights[3].slider("Number of Friends Rated", 0.0, 10.0, 0.0, 0.5)
+        # re-scoring the cached aggregates is instant, only the movies scraped with the default weights have details
+        df_recom = score_recommendations(df_recom_agg, r_w, l_w, fs_w, nor_w)
+        df_recom = df_recom.sort_values('index', ascending=False).reset_index(drop=True)
+        df_recom = df_recom[df_recom['no_of_rate'] > 1].reset_index(drop=True)
+        df_recom = df_recom.iloc[:100]
+        df_recom = pd.merge(df_recom, df_recom_details, how='left', left_on='id', right_on='id')
+        df_recom['ltw_ratio'] = df_recom['liked_by']/df_recom['watched_by']
 
         st.header("🗒️ Your Top 10 Movies to Watch")
         row_movies = {}
@@ -1175,7 +1033,7 @@ elif selected_sect == sections[1]:
             st.download_button(
                 "Download Movie Recommenations",
                 csv,
-                "{}_Movie Recommendations.csv".format(filename),
+                "{}_Movie Recommendations.csv".format(recom_filename),
                 "text/csv",
                 key='download-csv'
             )
@@ -0,0 +1,104 @@
+import os
+import time
+import argparse
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import engine
+import jobs
+import result_store
+import run_log
+
+# a run started from this hour on is stored for the next day, when the app will look it up
+NEXT_DAY_HOUR = 18
+
+def run_user(steps):
+    """
+    runs the job functions of one user one after the other and saves their frames, in a process of the pool
+    :param: steps: list of (kind, params, snapshot)
+    :rtype: returns the seconds it took and the number of pages requested
+    """
+    start = time.time()
+    requests_before = engine.requests_made()
+    for kind, params, snapshot in steps:
+        frames = jobs.JOB_KINDS[kind](report=lambda *args, **kwargs: None, **params)
+        result_store.save_frames(snapshot, frames)
+    return time.time()-start, engine.requests_made()-requests_before
+
+def default_date(now=None):
+    """
+    :rtype: returns today's date, or tomorrow's when the batch is started in the evening
+    """
+    now = datetime.now() if now is None else now
+    if now.hour >= NEXT_DAY_HOUR:
+        return now.date()+timedelta(days=1)
+    return now.date()
+
+def user_tasks(usernames, profile, friends, ftype, limit, today):
+    """
+    :rtype: returns a list of (username, name, steps, run log table, run log row), see run_user for the steps
+    """
+    tasks = []
+    for username in usernames:
+        if profile:
+            tasks.append((username, 'profile', [('profile', {'username': username}, result_store.profile_snapshot(today, username))],
+                          'log_detail', [str(today), username]))
+        if friends:
+            # the recommendations read the scores of the friends, so both run in the same process
+            friends_snapshot = result_store.friends_snapshot(today, username, ftype)
+            tasks.append((username, 'friends', [('friends', {'username': username, 'ftype': ftype}, friends_snapshot),
+                                                ('recommendations', {'username': username, 'friends': friends_snapshot, 'limit': limit},
+                                                 result_store.recommendations_snapshot(today, username, ftype, limit))],
+                          'log', [str(today), username, ftype, limit]))
+    return tasks
+
+def main():
+    parser = argparse.ArgumentParser(description="precomputes the app's results for many users, e.g. overnight, "
+                                                 "so that they are served from the result store on the day given by --date")
+    parser.add_argument('usernames', help='file with one Letterboxd username per line')
+    parser.add_argument('--profile', action='store_true', help='run the profile analysis')
+    parser.add_argument('--friends', action='store_true', help='run the friends ranker')
+    parser.add_argument('--ftype', default='following', choices=['following', 'followers', 'both', 'mutual'])
+    parser.add_argument('--limit', type=int, default=20, help='minimum movies both have rated')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--date', type=date.fromisoformat, default=default_date(),
+                        help='day the results are stored for, YYYY-MM-DD, today or tomorrow from {}:00 by default'.format(NEXT_DAY_HOUR))
+    parser.add_argument('--force', action='store_true', help='run again the users already stored for that day')
+    args = parser.parse_args()
+    if not (args.profile or args.friends):
+        parser.error('choose --profile and/or --friends')
+
+    with open(args.usernames) as f:
+        usernames = list(dict.fromkeys(line.strip() for line in f if line.strip() != ''))
+    # the app looks its runs up in the local database, the spreadsheet only keeps the history
+    runs = run_log.RunLog([run_log.SQLiteBackend()])
+    tasks = []
+    for username, name, steps, table, row in user_tasks(usernames, args.profile, args.friends, args.ftype, args.limit, args.date):
+        if not args.force:
+            # e.g. the friends were scored today for another limit
+            steps = [step for step in steps if not os.path.exists(result_store.snapshot_path(step[2]))]
+        if (len(steps) == 0) and runs.exists(table, row):
+            print("{} {}: already stored".format(username, name))
+        else:
+            tasks.append((username, name, steps, table, row))
+
+    print("==== STORING {} RUNS FOR {} ====".format(len(tasks), args.date))
+    start = time.time()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {executor.submit(run_user, steps): (username, name, table, row)
+                   for username, name, steps, table, row in tasks}
+        for future in as_completed(futures):
+            username, name, table, row = futures[future]
+            try:
+                seconds, n_requests = future.result()
+            except Exception as e:
+                failed = failed+1
+                print("{} {}: failed, {}: {}".format(username, name, type(e).__name__, e))
+            else:
+                runs.record(table, row)
+                print("{} {}: {:.1f}s, {} requests".format(username, name, seconds, n_requests))
+    runs.flush()
+    print("==== {} RUNS IN {:.1f}s, {} FAILED ====".format(len(tasks), time.time()-start, failed))
+
+if __name__ == '__main__':
+    main()
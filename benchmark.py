@@ -0,0 +1,132 @@
+import os
+import ast
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+# the scraping workers are other processes, they don't delay the script and aren't started here
+os.environ.setdefault('JOB_WORKERS', '0')
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+# seconds, about 1.5x what the landing page took when the budgets were set (imports 1.4-1.6s, first run 1.8-2.2s, reruns 0.16-0.24s)
+IMPORT_BUDGET = 2.5
+FIRST_RUN_BUDGET = 3.0
+RERUN_BUDGET = 0.35
+# cast rows weighted by analysis.billing_weights, about a profile of 1,700 movies: 0.007s, the loop 0.5s on int32 ids
+# and 9.7s on the string ids the frames had before FRAME_DTYPES
+BILLING_ROWS = 50000
+BILLING_BUDGET = 0.05
+
+def import_time(repeat, path=APP_PATH):
+    """
+    imports the top-level imports of the app in fresh interpreters, like the first session of a new server process
+    :param: repeat: number of interpreters, the fastest one is kept since the others only add noise from the machine
+    :rtype: returns the seconds the imports took
+    """
+    with open(path) as f:
+        imports = [ast.unparse(node) for node in ast.parse(f.read()).body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    code = "import sys, time\nsys.path.insert(0, {!r})\nstart = time.perf_counter()\n{}\nprint(time.perf_counter()-start)".format(
+        os.path.dirname(path), '\n'.join(imports))
+    times = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        times.append(float(output.stdout.split()[-1]))
+    return min(times)
+
+def run_times(reruns, path=APP_PATH):
+    """
+    runs the landing page of each section through streamlit's AppTest, the same script runs a browser session triggers
+    :rtype: returns the seconds of the first run and a dict of section to the seconds of each rerun
+    """
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(path, default_timeout=60)
+    # the spreadsheet is only reached when a run is logged, the landing page never does
+    at.secrets['SAMPLE_SPREADSHEET_ID_input'] = 'benchmark'
+    start = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter()-start
+    if len(at.exception) > 0:
+        raise RuntimeError(at.exception[0].value)
+
+    times = {}
+    for section in at.sidebar.selectbox[0].options:
+        at.sidebar.selectbox[0].set_value(section).run()
+        times[section] = []
+        for i in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            times[section].append(time.perf_counter()-start)
+    return first_run, times
+
+def billing_weights_loop(df_actor):
+    # the per-movie scan billing_weights replaced in the actor ranking
+    list_weights = []
+    movie_ids = df_actor['id'].unique()
+    for movie_id in movie_ids:
+        n_actor = df_actor.loc[df_actor['id']==movie_id].shape[0]
+        for i in range(n_actor):
+            weight = 1-i/n_actor
+            list_weights.append(weight)
+    return list_weights
+
+def billing_times(n_rows):
+    """
+    weights n_rows cast rows with analysis.billing_weights and with the loop it replaced
+    :rtype: returns the seconds of billing_weights, the seconds of the loop and whether their weights are the same
+    """
+    from analysis import billing_weights
+    rng = np.random.default_rng(0)
+    # 1 to 60 billed actors per movie, the rows of a movie together as they are scraped
+    n_actors = rng.integers(1, 61, n_rows//30)
+    n_actors = n_actors[:np.searchsorted(np.cumsum(n_actors), n_rows)+1]
+    df_actor = pd.DataFrame({'id': np.repeat(rng.permutation(1000000)[:len(n_actors)], n_actors)}).iloc[:n_rows]
+    start = time.perf_counter()
+    weights = billing_weights(df_actor)
+    seconds = time.perf_counter()-start
+    start = time.perf_counter()
+    list_weights = billing_weights_loop(df_actor)
+    loop_seconds = time.perf_counter()-start
+    return seconds, loop_seconds, np.array_equal(weights.to_numpy(), list_weights)
+
+def main():
+    parser = argparse.ArgumentParser(description="times the app's imports, first run and reruns and the analysis "
+                                                 "steps, and exits with 1 when one of them is over its budget")
+    parser.add_argument('--imports', type=int, default=3, help='fresh interpreters timing the imports, the fastest is compared')
+    parser.add_argument('--reruns', type=int, default=10, help='reruns per section, the median is compared')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET, help='seconds')
+    parser.add_argument('--first-run-budget', type=float, default=FIRST_RUN_BUDGET, help='seconds')
+    parser.add_argument('--rerun-budget', type=float, default=RERUN_BUDGET, help='seconds')
+    parser.add_argument('--billing-rows', type=int, default=BILLING_ROWS, help='cast rows of the billing weights check, 0 to skip it')
+    parser.add_argument('--billing-budget', type=float, default=BILLING_BUDGET, help='seconds')
+    args = parser.parse_args()
+
+    # the app keeps cache/ and log/ relative to where it is started, the sweeper of a run here would clean the repo's log/
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        checks = [('imports', import_time(args.imports), args.import_budget)]
+        first_run, times = run_times(args.reruns)
+        os.chdir(cwd)
+    checks.append(('first run', first_run, args.first_run_budget))
+    for section in times:
+        checks.append(('rerun, {}'.format(section), float(np.median(times[section])), args.rerun_budget))
+
+    failed = 0
+    if args.billing_rows > 0:
+        seconds, loop_seconds, same = billing_times(args.billing_rows)
+        checks.append(('billing weights of {} cast rows (loop {:.2f}s)'.format(args.billing_rows, loop_seconds), seconds, args.billing_budget))
+        if not same:
+            failed = failed+1
+            print("==== BILLING WEIGHTS DIFFER FROM THE LOOP ====")
+    for name, seconds, budget in checks:
+        ok = seconds <= budget
+        failed = failed+(not ok)
+        print("{:<55} {:>6.3f}s  budget {:.3f}s  {}".format(name, seconds, budget, 'ok' if ok else 'OVER BUDGET'))
+    print("==== {} OF {} CHECKS FAILED ====".format(failed, len(checks)+(args.billing_rows > 0)))
+    sys.exit(1 if failed > 0 else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import threading
+import time
+import film_store
+import result_store
+
+DAY = 24*60*60
+# bytes the result snapshots in the store may take together
+CACHE_BUDGET = 1024*1024*1024
+# seconds a result snapshot is kept after it was written, snapshots of unknown kind get the shortest
+ARTIFACT_TTL = {
+    'profile': DAY,
+    'friends': DAY,
+    'recommendations': DAY,
+}
+# seconds stored scraped data is kept after it was last fetched
+STORE_TTL = {
+    'films': 180*DAY,
+    'user_films': 30*DAY,
+    'friends': 7*DAY,
+}
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # removed meanwhile, e.g. by the sweeper of another process
+                pass
+    return size
+
+class CacheManager:
+    """
+    keeps the result store under a byte budget: snapshots expire after the TTL of their kind, and the least
+    recently used ones are evicted when the store grows over budget. A background thread sweeps every
+    sweep_interval seconds and also prunes the scraped data in the film store by STORE_TTL.
+    """
+    def __init__(self, path=result_store.STORE_PATH, budget=CACHE_BUDGET, ttl=ARTIFACT_TTL, store_ttl=STORE_TTL,
+                 sweep_interval=10*60):
+        self.path = path
+        self.budget = budget
+        self.ttl = ttl
+        self.store_ttl = store_ttl
+        self.sweep_interval = sweep_interval
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._artifacts = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._scan(time.time())
+        self._thread = threading.Thread(target=self._run, name='cache-sweeper', daemon=True)
+        self._thread.start()
+
+    def add(self, snapshot, kind):
+        """
+        registers a snapshot that was just written to the result store
+        :param: kind: one of ARTIFACT_TTL
+        """
+        now = time.time()
+        size = _size(result_store.snapshot_path(snapshot, self.path))
+        with self._lock:
+            self._artifacts[snapshot] = {'kind': kind, 'size': size, 'created_at': now, 'accessed_at': now}
+        if self.size() > self.budget:
+            self.sweep()
+
+    def lookup(self, snapshot):
+        """
+        :rtype: returns whether the snapshot can be read from the result store, and counts the hit or miss
+        """
+        now = time.time()
+        file_path = result_store.snapshot_path(snapshot, self.path)
+        with self._lock:
+            artifact = self._artifacts.get(snapshot)
+            if (artifact is None) and os.path.exists(file_path):
+                # written by another process, e.g. the batch CLI
+                mtime = os.path.getmtime(file_path)
+                artifact = self._artifacts[snapshot] = {'kind': None, 'size': _size(file_path), 'created_at': mtime, 'accessed_at': mtime}
+            if (artifact is None) or self._expired(artifact, now) or (not os.path.exists(file_path)):
+                self.counters['misses'] += 1
+                return False
+            self.counters['hits'] += 1
+            artifact['accessed_at'] = now
+        # the access time survives a restart through the modification time
+        os.utime(file_path, (now, now))
+        return True
+
+    def size(self):
+        with self._lock:
+            return sum(artifact['size'] for artifact in self._artifacts.values())
+
+    def stats(self):
+        """
+        :rtype: returns the hit, miss and eviction counters with the number and bytes of the stored snapshots
+        """
+        with self._lock:
+            return dict(self.counters, snapshots=len(self._artifacts), bytes=sum(a['size'] for a in self._artifacts.values()))
+
+    def _expired(self, artifact, now):
+        ttl = self.ttl[artifact['kind']] if artifact['kind'] in self.ttl else min(self.ttl.values())
+        return now-artifact['created_at'] > ttl
+
+    def _scan(self, now):
+        """
+        registers the snapshots written before this process started or by another process (the batch CLI, a
+        worker whose session never looked them up), their last access being the modification time, and forgets
+        the ones another process removed
+        """
+        for name in os.listdir(self.path):
+            file_path = os.path.join(self.path, name)
+            try:
+                mtime = os.path.getmtime(file_path)
+            except FileNotFoundError:
+                continue
+            if result_store.is_temporary(name):
+                # left behind by a save that was killed, a save in progress is much younger
+                if now-mtime > min(self.ttl.values()):
+                    shutil.rmtree(file_path, ignore_errors=True)
+                continue
+            with self._lock:
+                known = name in self._artifacts
+            if not known:
+                size = _size(file_path)
+                with self._lock:
+                    self._artifacts.setdefault(name, {'kind': None, 'size': size, 'created_at': mtime, 'accessed_at': mtime})
+        with self._lock:
+            gone = [name for name in self._artifacts if not os.path.exists(os.path.join(self.path, name))]
+            for name in gone:
+                del self._artifacts[name]
+
+    def sweep(self):
+        """
+        removes the expired snapshots, then the least recently used ones until the store fits the budget
+        """
+        now = time.time()
+        self._scan(now)
+        with self._lock:
+            expired = [name for name, artifact in self._artifacts.items() if self._expired(artifact, now)]
+            by_access = sorted((name for name in self._artifacts if name not in expired), key=lambda name: self._artifacts[name]['accessed_at'])
+            size = sum(self._artifacts[name]['size'] for name in by_access)
+            evicted = []
+            while (size > self.budget) and (len(by_access) > 0):
+                name = by_access.pop(0)
+                size -= self._artifacts[name]['size']
+                evicted.append(name)
+            for name in expired+evicted:
+                del self._artifacts[name]
+            self.counters['evictions'] += len(expired)+len(evicted)
+        for name in expired+evicted:
+            file_path = os.path.join(self.path, name)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path, ignore_errors=True)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+            print("Deleted: {}".format(name))
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+                film_store.prune(self.store_ttl)
+                print("==== CACHE {} ====".format(self.stats()))
+            except Exception as e:
+                print("==== CACHE SWEEP FAILED: {} ====".format(e))
+            time.sleep(self.sweep_interval)
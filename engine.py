@@ -0,0 +1,936 @@
+from bs4 import BeautifulSoup
+import requests
+import cloudscraper
+import pandas as pd
+import numpy as np
+from scipy import sparse
+import os
+import queue
+import random
+import threading
+import time
+import film_store
+try:
+    import fcntl
+except ImportError:
+    # no file locks (Windows), the cap only holds within a process
+    fcntl = None
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+DOMAIN = "https://letterboxd.com"
+# number of pages fetched at the same time for one profile
+MAX_WORKERS = 8
+# number of friend profiles scraped at the same time
+FRIEND_WORKERS = 8
+# cap on requests in flight across every pool of every process of the machine (app workers, batch CLI)
+MAX_CONNECTIONS = int(os.environ.get('MAX_CONNECTIONS', 16))
+# directory of the lock files that hold the MAX_CONNECTIONS slots
+CONNECTION_SLOTS_PATH = os.path.join('cache', 'connections')
+# statuses of a response that is requested again, rate limited or a server error
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# times a page is requested again, waiting RETRY_DELAY seconds the first time and twice as long every next time
+MAX_RETRIES = 4
+RETRY_DELAY = 1.0
+# longest wait a Retry-After header is followed for
+MAX_RETRY_DELAY = 60.0
+# seconds to connect and between two bytes of a response, a stalled connection gives its slot back and is retried
+REQUEST_TIMEOUT = 30
+# listing of a user's films, most recent first, used for incremental refreshes
+RECENT_PATH = "/films/by/date/"
+# age in seconds after which an incremental refresh falls back to a full scrape
+FULL_REFRESH_AGE = 7*24*60*60
+# age in seconds after which a stored following/followers list is scraped again
+FRIENDS_REFRESH_AGE = 24*60*60
+# cloudscraper sessions of the process that aren't serving a request, the last one given back is taken first
+_scrapers = queue.LifoQueue()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_requests_made = 0
+_requests_lock = threading.Lock()
+# compact dtypes of the scraped frames, applied once when a frame is built
+FRAME_DTYPES = {
+    'id': 'int32',
+    'rating': 'float32',
+    'liked': 'bool',
+    'avg_rating': 'float32',
+    'year': 'Int16',
+    'runtime': 'Int16',
+    'actor': 'category',
+    'actor_link': 'category',
+    'director': 'category',
+    'director_link': 'category',
+    'genre': 'category',
+    'theme': 'category',
+}
+
+STARS = {
+    "★": 1,
+    "★★": 2,
+    "★★★": 3,
+    "★★★★": 4,
+    "★★★★★": 5,
+    "½": 0.5,
+    "★½": 1.5,
+    "★★½": 2.5,
+    "★★★½": 3.5,
+    "★★★★½": 4.5
+}
+
+class ScrapeError(Exception):
+    """
+    a page that could not be scraped
+    :param: url: the page requested
+    :param: status_code: HTTP status of the response, None when there was no response (connection error, timeout)
+    """
+    def __init__(self, url, status_code):
+        super().__init__("{} returned {}".format(url, status_code) if status_code is not None else "{} got no response".format(url))
+        self.url = url
+        self.status_code = status_code
+
+    def __reduce__(self):
+        # raised in worker processes and pickled back to the caller
+        return (ScrapeError, (self.url, self.status_code))
+
+def transform_ratings(some_strs):
+    """
+    transforms raw star ratings into float values
+    :param: some_strs: actual star ratings, e.g. all the ratings of one page
+    :rtype: returns the float representation of each given star(s), -1 for unrated
+    """
+    return [STARS.get(some_str, -1) for some_str in some_strs]
+
+def get_scraper():
+    """
+    takes a cloudscraper session out of the process's sessions, a new one when they are all serving a request,
+    to give back with put_scraper. A session serves one request at a time, and it outlives the thread pools of
+    fetch_films and scrape_films_details, so its connections and cookies are reused across profiles
+    """
+    try:
+        return _scrapers.get_nowait()
+    except queue.Empty:
+        return cloudscraper.create_scraper()
+
+def put_scraper(scraper):
+    _scrapers.put(scraper)
+
+class ConnectionSlots:
+    """
+    a semaphore shared by every process that runs in the same directory: a slot is an exclusive lock on one of
+    n files, so it is released by the system when the process holding it dies
+    """
+    def __init__(self, n, path=CONNECTION_SLOTS_PATH):
+        self.n = n
+        self.path = path
+        self._local = threading.local()
+        self._semaphore = threading.BoundedSemaphore(n) if fcntl is None else None
+
+    def __enter__(self):
+        if fcntl is None:
+            self._semaphore.acquire()
+            return self
+        os.makedirs(self.path, exist_ok=True)
+        delay = 0.005
+        while True:
+            # starting from a random slot spreads the processes over the files
+            start = random.randrange(self.n)
+            for i in range(self.n):
+                fd = os.open(os.path.join(self.path, str((start+i)%self.n)), os.O_RDWR | os.O_CREAT)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                self._local.fd = fd
+                return self
+            time.sleep(delay)
+            delay = min(2*delay, 0.1)
+
+    def __exit__(self, *exc):
+        if fcntl is None:
+            self._semaphore.release()
+        else:
+            fd = self._local.fd
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+_request_slots = ConnectionSlots(MAX_CONNECTIONS)
+
+def retry_delay(response, attempt):
+    """
+    :param: response: None when the request failed without one
+    :rtype: returns the seconds to wait before requesting a page again, the Retry-After of the response if any
+    """
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_DELAY)
+    return RETRY_DELAY*(2**attempt)*random.uniform(0.5, 1.5)
+
+def fetch_page(url):
+    """
+    requests a page in one of the MAX_CONNECTIONS slots, again after a backoff while it is rate limited, fails
+    on the server or the connection fails, up to MAX_RETRIES times
+    :rtype: returns the last response, raises ScrapeError with no status when the last attempt got none
+    """
+    global _requests_made
+    for attempt in range(MAX_RETRIES+1):
+        with _requests_lock:
+            _requests_made = _requests_made+1
+        try:
+            # at most one session per slot is ever created
+            with _request_slots:
+                scraper = get_scraper()
+                try:
+                    url_page = scraper.get(url, timeout=REQUEST_TIMEOUT)
+                finally:
+                    put_scraper(scraper)
+        except requests.RequestException as e:
+            if attempt == MAX_RETRIES:
+                raise ScrapeError(url, None) from e
+            url_page = None
+        else:
+            if (url_page.status_code not in RETRY_STATUS) or (attempt == MAX_RETRIES):
+                return url_page
+        # the slot is given back while waiting
+        time.sleep(retry_delay(url_page, attempt))
+
+def requests_made():
+    """
+    :rtype: returns the number of pages the process has requested so far
+    """
+    return _requests_made
+
+def fetch_ok(url):
+    """
+    :rtype: returns the response of a page that has to be there, raises ScrapeError otherwise
+    """
+    url_page = fetch_page(url)
+    if url_page.status_code != 200:
+        raise ScrapeError(url, url_page.status_code)
+    return url_page
+
+def single_flight(key, fn, *args):
+    """
+    runs fn once for all the callers of the process that ask for the same key at the same time,
+    the others wait for it and share its result (or its exception)
+    :param: key: what is fetched, e.g. ('films', username, incremental) or ('film', link)
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        result = fn(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+def typed(df):
+    """
+    casts the columns of a freshly built frame to their FRAME_DTYPES, numbers may still be strings
+    :rtype: returns df with the compact dtypes
+    """
+    for column in df.columns:
+        if column not in FRAME_DTYPES:
+            continue
+        if FRAME_DTYPES[column] not in ['bool', 'category']:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+        df[column] = df[column].astype(FRAME_DTYPES[column])
+    return df
+
+def parse_films_page(soup, movies_dict):
+    """
+    appends the films listed on one /films/ grid page into movies_dict
+    """
+    ul = soup.find("ul", {"class": "grid"})
+    if (ul != None):
+        movies = ul.find_all("li")
+        stars = []
+        for movie in movies:
+            movies_dict['id'].append(movie.find('div')['data-film-id'])
+            movies_dict['title'].append(movie.find('img')['alt'])
+            stars.append(movie.find('p', {"class": "poster-viewingdata"}).get_text().strip())
+            movies_dict['liked'].append(movie.find('span', {'class': 'like'})!=None)
+            movies_dict['link'].append(movie.find('div')['data-target-link'])
+        movies_dict['rating'].extend(transform_ratings(stars))
+
+def refresh_films(username, df_snapshot):
+    """
+    brings a stored film list up to date by reading the user's films sorted by date until it reaches
+    films that are already in the snapshot with the same rating and like
+    :rtype: returns the merged film list, new films first
+    """
+    snapshot = {}
+    for i, (id_movie, rating, liked) in enumerate(zip(df_snapshot['id'], df_snapshot['rating'], df_snapshot['liked'])):
+        snapshot[int(id_movie)] = (i, rating, liked)
+    movies_dict = {}
+    movies_dict['id'] = []
+    movies_dict['title'] = []
+    movies_dict['rating'] = []
+    movies_dict['liked'] = []
+    movies_dict['link'] = []
+    page = 1
+    while True:
+        url = DOMAIN + "/" + username + RECENT_PATH
+        if page > 1:
+            url = url + "page/" + str(page) + "/"
+        url_page = fetch_ok(url)
+        soup = BeautifulSoup(url_page.content, 'html.parser')
+        n_rows = len(movies_dict['id'])
+        parse_films_page(soup, movies_dict)
+        reached = False
+        for id_movie, rating, liked in zip(movies_dict['id'][n_rows:], movies_dict['rating'][n_rows:], movies_dict['liked'][n_rows:]):
+            if (int(id_movie) in snapshot) and (snapshot[int(id_movie)][1:] == (rating, liked)):
+                reached = True
+        # stop at the first page that overlaps the snapshot, or at the last page
+        if reached or (len(movies_dict['id']) == n_rows) or (soup.find('a', {'class':'next'}) is None):
+            break
+        page = page+1
+
+    df_recent = typed(pd.DataFrame(movies_dict)).drop_duplicates('id')
+    df_new = df_recent[~df_recent['id'].isin(snapshot)]
+    df_changed = df_recent[df_recent['id'].isin(snapshot)].set_index('id')
+    df_film = df_snapshot.copy()
+    changed = df_film['id'].isin(df_changed.index)
+    df_film.loc[changed, 'rating'] = df_changed.loc[df_film.loc[changed, 'id'], 'rating'].values
+    df_film.loc[changed, 'liked'] = df_changed.loc[df_film.loc[changed, 'id'], 'liked'].values
+    df_film = pd.concat([df_new, df_film]).drop_duplicates('id').reset_index(drop=True)
+    print("==== REFRESHED {} WITH {} PAGES, {} NEW FILMS ====".format(username, page, len(df_new)))
+    return df_film
+
+def scrape_films(username, max_workers=MAX_WORKERS, incremental=False, on_error=None):
+    """
+    :param: incremental: refresh the stored film list of the user, unless it is older than FULL_REFRESH_AGE
+    :param: on_error: called with the ScrapeError of a page after the first one that failed, the movies of
+                      that page are left out; the error is printed when None. A missing profile still raises
+    :rtype: returns the rated movies of the user (id, title, rating, liked, link), -1 for unrated
+    """
+    if on_error is None:
+        on_error = print
+    # a profile scraped by several sessions or jobs at once, e.g. a friend they share, is fetched once per mode:
+    # the profile page needs the full grid in its default order, which a refresh doesn't keep
+    with _in_flight_lock:
+        full = _in_flight.get(('films', username, False))
+    if incremental and (full is not None):
+        # a full scrape is at least as fresh as a refresh, the reverse isn't true
+        df_film, errors = full.result()
+    else:
+        df_film, errors = single_flight(('films', username, incremental), fetch_films, username, max_workers, incremental)
+    # every caller hears about the pages left out, not only the one that ran the scrape
+    for e in errors:
+        on_error(e)
+    return df_film
+
+def fetch_films(username, max_workers=MAX_WORKERS, incremental=False):
+    """
+    :rtype: returns the rated movies of the user and the ScrapeErrors of the pages left out, see scrape_films
+    """
+    if incremental:
+        df_snapshot, synced_at = film_store.load_user_films(username)
+        if (df_snapshot is not None) and (time.time()-synced_at < FULL_REFRESH_AGE):
+            df_film = refresh_films(username, typed(df_snapshot))
+            film_store.save_user_films(username, df_film, synced_at)
+            return df_film, []
+    print("==== SCRAPING FOR USERNAME {} ====".format(username))
+    movies_dict = {}
+    movies_dict['id'] = []
+    movies_dict['title'] = []
+    movies_dict['rating'] = []
+    movies_dict['liked'] = []
+    movies_dict['link'] = []
+    url = DOMAIN + "/" + username + "/films/"
+    url_page = fetch_ok(url)
+    soup = BeautifulSoup(url_page.content, 'html.parser')
+    
+    # the first page is already in hand, the rest are fetched in parallel
+    parse_films_page(soup, movies_dict)
+    errors = []
+    li_pagination = soup.findAll("li", {"class": "paginate-page"})
+    if len(li_pagination) != 0:
+        n_pages = int(li_pagination[-1].find('a').get_text().strip())
+        urls = [DOMAIN + "/" + username + "/films/page/" + str(i+1) for i in range(1, n_pages)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # the pages are read in order, so rows are stitched back as page 2..N
+            for future in [executor.submit(fetch_ok, url) for url in urls]:
+                try:
+                    url_page = future.result()
+                except ScrapeError as e:
+                    errors.append(e)
+                    continue
+                soup = BeautifulSoup(url_page.content, 'html.parser')
+                parse_films_page(soup, movies_dict)
+    
+    # a film pushed to the next page while the pages were fetched is listed twice
+    df_film = typed(pd.DataFrame(movies_dict)).drop_duplicates('id').reset_index(drop=True)
+    # a list with missing pages isn't stored, the next scrape starts over from a full one
+    if len(errors) == 0:
+        film_store.save_user_films(username, df_film)
+    return df_film, errors
+
+def score_index(rating_x, liked_x, rating_y, liked_y):
+    score = 0.0
+    if ((rating_x == rating_y) & (liked_x == liked_y)):
+        score = 2.0
+    # both like but different ratings
+    elif ((liked_x == True) & (liked_x == liked_y)):
+        score = 2.0-(abs(rating_x-rating_y)/5)
+    else:
+        score = 1.0-(abs(rating_x-rating_y)/5)
+    return score
+
+def score_index_array(rating_x, liked_x, rating_y, liked_y):
+    """
+    vectorized score_index, scores every pair of ratings and likes at once
+    :rtype: returns a float array with the same values score_index gives row by row
+    """
+    rating_x = np.asarray(rating_x, dtype=float)
+    rating_y = np.asarray(rating_y, dtype=float)
+    liked_x = np.asarray(liked_x)
+    liked_y = np.asarray(liked_y)
+    difference = np.abs(rating_x-rating_y)/5
+    return np.where((rating_x == rating_y) & (liked_x == liked_y), 2.0,
+                    np.where((liked_x == True) & (liked_x == liked_y), 2.0-difference, 1.0-difference))
+
+# a rated movie is one of 20 states, ratings ½..★★★★★ times liked or not
+N_STATES = 20
+_state_rating = np.repeat(np.arange(1, 11)/2, 2)
+_state_liked = np.tile([False, True], 10)
+# score_index of every (friend state, user state) pair
+SCORE_TABLE = score_index_array(np.repeat(_state_rating, N_STATES), np.repeat(_state_liked, N_STATES),
+                                np.tile(_state_rating, N_STATES), np.tile(_state_liked, N_STATES))
+
+def comparison_frames(username_a, df_a, username_b, df_b):
+    """
+    :rtype: returns the movies both users liked, the movies both rated and the movies they rated differently
+    """
+    # movies they both liked
+    df_liked = pd.merge(df_a[['id', 'title', 'link', 'liked']], df_b[['id', 'liked']])
+    df_liked = df_liked[df_liked['liked']==True].reset_index(drop=True)
+    
+    # movies they gave same rate
+    df_same = pd.merge(df_a[['id', 'title', 'rating']], df_b[['id', 'rating']])
+    
+    # movies they gave different rate
+    df_different = pd.merge(df_a[['id', 'title', 'rating']], df_b[['id', 'rating']], how='inner', on='id')
+    df_different = df_different[df_different['rating_x']!=df_different['rating_y']].reset_index(drop=True)
+    df_different['difference'] = df_different['rating_x']-df_different['rating_y']
+    df_different['difference_abs'] = abs(df_different['rating_x']-df_different['rating_y'])
+    df_different = df_different.rename(columns={'rating_x': 'rating_{0}'.format(username_a), 'rating_y': 'rating_{0}'.format(username_b)})
+    return df_liked, df_same, df_different
+
+def compare_ratings_friends(username_a, df_a, username_b, df_b):
+    df_liked, df_same, df_different = comparison_frames(username_a, df_a, username_b, df_b)
+    
+    # calculate index
+    df_merge = pd.merge(df_a, df_b, on = ['id', 'title'])
+    if len(df_merge) > 0:
+        df_merge['score'] = score_index_array(df_merge['rating_x'], df_merge['liked_x'],
+                                              df_merge['rating_y'], df_merge['liked_y'])
+        index = df_merge['score'].sum()/(2*len(df_merge))
+    else:
+        index = 0
+    return df_liked, df_same, df_different, index
+
+class FriendsData(Mapping):
+    """
+    friends_data[username_b] gives the movies of a friend ('df_b') and the comparison frames with the
+    user ('df_liked', 'df_same', 'df_different'). Only the movies are kept, the comparison frames are
+    derived the first time they are read and are not pickled.
+    """
+    def __init__(self, username, df_a, friends_films):
+        self.username = username
+        self.df_a = df_a
+        self.friends_films = friends_films
+        self._frames = {}
+
+    def __getitem__(self, username_b):
+        if username_b not in self.friends_films:
+            raise KeyError(username_b)
+        return FriendFrames(self, username_b)
+
+    def __iter__(self):
+        return iter(self.friends_films)
+
+    def __len__(self):
+        return len(self.friends_films)
+
+    def __reduce__(self):
+        # pickling and st.cache_data hashing both go through here, the derived frames are left out
+        return (FriendsData, (self.username, self.df_a, self.friends_films))
+
+    def to_frame(self):
+        """
+        :rtype: returns the movies of all friends in one frame, the friend in the username column
+        """
+        usernames = list(self.friends_films.keys())
+        df_films = pd.concat([self.friends_films[i] for i in usernames]+[self.df_a.iloc[:0]], ignore_index=True)
+        df_films.insert(0, 'username', pd.Categorical(np.repeat(usernames, [len(self.friends_films[i]) for i in usernames]),
+                                                      categories=usernames))
+        return df_films
+
+    @classmethod
+    def from_frame(cls, username, df_a, df_films):
+        """
+        rebuilds the FriendsData that to_frame was called on
+        """
+        rows = df_films.groupby('username', observed=True).indices
+        friends_films = {}
+        for username_b in df_films['username'].cat.categories:
+            friends_films[username_b] = df_films.iloc[rows.get(username_b, [])].drop(columns='username').reset_index(drop=True)
+        return cls(username, df_a, friends_films)
+
+    def frames(self, username_b):
+        if username_b not in self._frames:
+            df_liked, df_same, df_different = comparison_frames(self.username, self.df_a, username_b, self.friends_films[username_b])
+            self._frames[username_b] = {'df_liked': df_liked, 'df_same': df_same, 'df_different': df_different}
+        return self._frames[username_b]
+
+class FriendFrames(Mapping):
+    """
+    the frames of one friend, see FriendsData
+    """
+    FRAMES = ('df_b', 'df_liked', 'df_same', 'df_different')
+
+    def __init__(self, friends_data, username_b):
+        self.friends_data = friends_data
+        self.username_b = username_b
+
+    def __getitem__(self, key):
+        if key == 'df_b':
+            return self.friends_data.friends_films[self.username_b]
+        return self.friends_data.frames(self.username_b)[key]
+
+    def __iter__(self):
+        return iter(self.FRAMES)
+
+    def __len__(self):
+        return len(self.FRAMES)
+
+def rating_states(ratings, liked):
+    """
+    encodes every (rating, liked) pair of a film list into one of N_STATES integer states
+    """
+    levels = np.rint(np.asarray(ratings, dtype=float)*2).astype(int)-1
+    return levels*2+np.asarray(liked, dtype=int)
+
+def batch_similarity(df_a, friends_films):
+    """
+    scores all friends against the user at once on a sparse (friend x film) matrix of rating/like states
+    :param: df_a: rated movies of the user
+    :param: friends_films: dict of friend username to his/her rated movies
+    :rtype: returns a DataFrame of username, index_score, no_of_movies and total_index in the order of friends_films
+    """
+    usernames = list(friends_films.keys())
+    df_friends = pd.DataFrame({'username': usernames, 'index_score': 0.0, 'no_of_movies': 0})
+    if len(usernames) > 0:
+        # a movie listed twice (e.g. the grid shifted between two page requests) is counted once
+        df_a = df_a.drop_duplicates('id')
+        frames = [df_b.drop_duplicates('id') for df_b in friends_films.values()]
+        df_all = pd.concat(frames, ignore_index=True)
+        rows = np.repeat(np.arange(len(usernames)), [len(df_b) for df_b in frames])
+        # columns are the movies of the user, movies only the friends rated can't be shared
+        cols = pd.Index(df_a['id']).get_indexer(df_all['id'])
+        shared = cols >= 0
+        states = sparse.csr_matrix((rating_states(df_all['rating'], df_all['liked'])[shared]+1, (rows[shared], cols[shared])),
+                                   shape=(len(usernames), len(df_a)))
+        # count shared movies per (friend state, user state) pair, then score every pair once
+        states = states.tocoo()
+        pairs = (states.data-1)*N_STATES+rating_states(df_a['rating'], df_a['liked'])[states.col]
+        counts = sparse.csr_matrix((np.ones(len(pairs)), (states.row, pairs)), shape=(len(usernames), N_STATES*N_STATES))
+        no_of_movies = np.asarray(counts.sum(axis=1)).ravel()
+        score = counts @ SCORE_TABLE
+        df_friends['no_of_movies'] = no_of_movies.astype(int)
+        df_friends['index_score'] = np.divide(score, 2*no_of_movies, out=np.zeros(len(usernames)), where=no_of_movies > 0)
+    df_friends['total_index'] = df_friends['index_score']*df_friends['no_of_movies']
+    return df_friends
+
+def scrape_friend_list(username, direction):
+    """
+    :param: direction: 'following' or 'followers'
+    :rtype: returns the usernames on every page of the user's following or followers list
+    """
+    friends_list = []
+    url = DOMAIN + "/" + username + "/{0}/".format(direction)
+    while True:
+        url_page = fetch_ok(url)
+        soup = BeautifulSoup(url_page.content, 'html.parser')
+        friends = soup.findAll('div', {'class':'person-summary'})
+
+        for friend in friends:
+            username_b = friend.find('a', {'class':'avatar'})['href'].replace('/','')
+            friends_list.append(username_b)
+
+        # check if there's next page
+        if soup.find('a', {'class':'next'}) is None:
+            break
+        else:
+            url = DOMAIN + soup.find('a', {'class':'next'})['href']
+    return friends_list
+
+def friend_list(username, direction):
+    """
+    the user's following or followers list, served from the store while it is younger than FRIENDS_REFRESH_AGE
+    """
+    friends_list, synced_at = film_store.load_friends(username, direction)
+    if (friends_list is None) or (time.time()-synced_at > FRIENDS_REFRESH_AGE):
+        friends_list = single_flight(('friends', username, direction), refresh_friend_list, username, direction)
+    return friends_list
+
+def refresh_friend_list(username, direction):
+    friends_list = scrape_friend_list(username, direction)
+    film_store.save_friends(username, direction, friends_list)
+    return friends_list
+
+def list_friends(username, ftype='following'):
+    """
+    :param: ftype: 'following', 'followers', 'both' or 'mutual'
+    :rtype: returns the usernames of the user's friends
+    """
+    friends_list = []
+    if ((ftype == 'following') | (ftype == 'followers')):
+        friends_list = friend_list(username, ftype)
+    elif (ftype == 'both'):
+        friends_list = list(dict.fromkeys(friend_list(username, 'following')+friend_list(username, 'followers')))
+    elif (ftype == 'mutual'):
+        followers_list = set(friend_list(username, 'followers'))
+        friends_list = [following for following in friend_list(username, 'following') if following in followers_list]
+    return friends_list
+
+def stream_friends(df_a, friends_list, max_workers=FRIEND_WORKERS, on_error=None):
+    """
+    scrapes the movies of every friend and scores each one against the user as soon as its profile is in
+    :param: df_a: rated movies of the user
+    :param: on_error: called with the ScrapeError of a friend's profile or page that failed, a friend whose
+                      profile failed is kept with no movies; the error is printed when None
+    :rtype: yields (username_b, no_of_movies, index_score, df_b) in the order the profiles complete,
+            df_b being the friend's rated movies
+    """
+    if on_error is None:
+        on_error = print
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scrape_films, username_b, MAX_WORKERS, True, on_error): username_b for username_b in friends_list}
+        for future in as_completed(futures):
+            username_b = futures[future]
+            try:
+                df_b = future.result()
+            except ScrapeError as e:
+                # no movies in common, so any limit leaves the friend out of the ranking
+                on_error(e)
+                df_b = df_a.iloc[:0]
+            df_b = df_b[df_b['rating']!=-1].reset_index(drop=True)
+            score = batch_similarity(df_a, {username_b: df_b})
+            yield username_b, int(score['no_of_movies'].iloc[0]), float(score['index_score'].iloc[0]), df_b
+
+def compare_friends(username, friends_list, max_workers=FRIEND_WORKERS, progress=None, on_friend=None, on_error=None):
+    """
+    scrapes the movies of the user and of every friend and scores all friends, whatever the limit
+    :param: progress: called from the calling thread with the number of friends scraped and the total
+    :param: on_friend: called from the calling thread with (username_b, no_of_movies, index_score) as each friend is scored
+    :param: on_error: see stream_friends, the user's own profile still raises ScrapeError
+    :rtype: returns the scores of batch_similarity, the dict of friend username to rated movies and the user's rated movies
+    """
+    df_a = scrape_films(username, incremental=True)
+    df_a = df_a[df_a['rating']!=-1].reset_index(drop=True)
+    
+    friends_films = {}
+    for username_b, no_of_movies, index_score, df_b in stream_friends(df_a, friends_list, max_workers, on_error):
+        print('scraped '+username_b + ', ({})'.format(username))
+        friends_films[username_b] = df_b
+        if on_friend is not None:
+            on_friend(username_b, no_of_movies, index_score)
+        if progress is not None:
+            progress(len(friends_films), len(friends_list))
+
+    # keep the order of friends_list regardless of completion order
+    friends_films = {username_b: friends_films[username_b] for username_b in friends_list}
+    print('comparing {} with {} friends'.format(username, len(friends_films)))
+    return batch_similarity(df_a, friends_films), friends_films, df_a
+
+def scrape_friends(username, friends_list, limit=20, max_workers=FRIEND_WORKERS, progress=None, on_friend=None, on_error=None):
+    """
+    compare_friends, then limit_friends
+    """
+    return limit_friends(username, *compare_friends(username, friends_list, max_workers, progress, on_friend, on_error), limit)
+
+def limit_friends(username, df_friends, friends_films, df_a, limit=20):
+    """
+    keeps the friends who rated at least limit of the user's movies
+    :rtype: returns the scores of the friends kept, their FriendsData and the user's rated movies
+    """
+    df_friends = df_friends[df_friends['no_of_movies'] >= limit].reset_index(drop=True)
+
+    # the comparison frames are only derived for the friends that get displayed
+    friends_data = FriendsData(username, df_a, {username_b: friends_films[username_b] for username_b in df_friends['username']})
+    return df_friends, friends_data, df_a
+
+def aggregate_recommendations(df_friends, friends_data, df_a):
+    """
+    aggregates the movies of the friends that the user hasn't rated
+    :rtype: returns one row per movie with the mean rating, number of likes, mean friends score and number of rates
+    """
+    friends_score = dict(zip(df_friends['username'], df_friends['total_index']))
+    usernames = list(friends_data.keys())
+    frames = [friends_data[i]['df_b'][['id', 'title', 'link', 'rating', 'liked']] for i in usernames]
+    scores = np.repeat([friends_score[i] for i in usernames], [len(frame) for frame in frames])
+    if len(frames) == 0:
+        # no friend reaches the limit, nothing is recommended but the frame keeps its columns
+        frames = [df_a.iloc[:0][['id', 'title', 'link', 'rating', 'liked']]]
+    df_movies = pd.concat(frames, ignore_index=True)
+    df_movies['friends_score'] = scores
+    
+    # leave out the movies the user has already rated
+    df_movies = df_movies[~df_movies['id'].isin(set(df_a['id']))]
+    # title and link follow from the id, so grouping on the id alone is enough
+    df_recom = df_movies.groupby('id', as_index=False).agg(title=('title', 'first'),
+                                                           link=('link', 'first'),
+                                                           rating=('rating', 'mean'),
+                                                           liked=('liked', 'sum'),
+                                                           friends_score=('friends_score', 'mean'),
+                                                           no_of_rate=('rating', 'size'))
+    return df_recom
+
+def score_recommendations(df_recom, r_w=6, l_w=3, fs_w=2, nor_w=0):
+    """
+    weights the aggregates of aggregate_recommendations into the recommendation index
+    :param: r_w: weight of the friends' average rating
+    :param: l_w: weight of the number of likes
+    :param: fs_w: weight of the friends' scores
+    :param: nor_w: weight of the number of rates
+    :rtype: returns a copy of df_recom with the index column
+    """
+    df_recom = df_recom.copy()
+    #df_recom['index'] = df_recom['rating']*3/5+df_recom['liked']/df_recom['no_of_rate']*6.5+4*df_recom['friends_score']/df_recom['friends_score'].max()+6.5*df_recom['no_of_rate']/df_recom['no_of_rate'].max()
+#     df_recom['index'] = df_recom['rating']*df_recom['friends_score']+df_recom['liked']*df_recom['no_of_rate']
+    df_recom['index'] = r_w/5*df_recom['rating']+l_w*df_recom['liked']/df_recom['liked'].max()+fs_w*df_recom['friends_score']/df_recom['friends_score'].max()+nor_w*df_recom['no_of_rate']/df_recom['no_of_rate'].max()
+    return df_recom
+
+def recommend_movies(df_friends, friends_data, df_a):
+    return score_recommendations(aggregate_recommendations(df_friends, friends_data, df_a))
+
+POPULARITY_BINS = [10000, 100000, 1000000]
+POPULARITY_LABELS = ["1 - very obscure", "2 - obscure", "3 - popular", "4 - very popular"]
+LIKEABILITY_BINS = [0.1, 0.2, 0.4]
+LIKEABILITY_LABELS = ["1 - rarely likeable", "2 - sometimes likeable", "3 - often likeable", "4 - usually likeable"]
+RUNTIME_BINS = [30, 60, 90, 120, 150, 180]
+RUNTIME_LABELS = ["less than 30m", "30m-1h", "1h-1h 30m", "1h 30m-2h", "2h-2h 30m", "2h 30m-3h", "at least 3h"]
+
+def bucket(values, bins, labels, right=True):
+    """
+    puts every value into the bucket between two consecutive bins
+    :param: values: Series of numbers
+    :param: right: whether a value equal to a bin belongs to the lower bucket (<= bin) or the upper one (< bin)
+    :rtype: returns an ordered categorical Series with len(bins)+1 labels, NaN lands in the last bucket
+    """
+    codes = np.searchsorted(bins, values.to_numpy(dtype=float, na_value=np.nan), side='left' if right else 'right')
+    return pd.Series(pd.Categorical.from_codes(codes, categories=labels, ordered=True), index=values.index)
+
+def decade_year(year):
+    """
+    :param: year: Series of release years, as numbers or strings
+    :rtype: returns an ordered categorical Series like "1990s", NaN where the year is missing
+    """
+    decade = np.trunc(pd.to_numeric(year).to_numpy(dtype=float, na_value=np.nan)/10)*10
+    decades = np.unique(decade[~np.isnan(decade)])
+    codes = np.where(np.isnan(decade), -1, np.searchsorted(decades, decade))
+    return pd.Series(pd.Categorical.from_codes(codes, categories=[str(int(d))+"s" for d in decades], ordered=True),
+                     index=year.index)
+
+def classify_popularity(watched_by):
+    return bucket(watched_by, POPULARITY_BINS, POPULARITY_LABELS)
+
+def classify_likeability(ltw_ratio):
+    return bucket(ltw_ratio, LIKEABILITY_BINS, LIKEABILITY_LABELS)
+
+def classify_runtime(runtime):
+    runtime_group = bucket(runtime, RUNTIME_BINS, RUNTIME_LABELS, right=False)
+    return runtime_group.where(runtime.notna())
+
+def parse_film_page(content):
+    """
+    extracts the details of a movie from its film page
+    :param: content: raw html of the film page
+    :rtype: returns a dict with avg_rating, year, runtime and the lists of actors, directors, genres and themes
+    """
+    film = {}
+    film['avg_rating'] = np.nan
+    film['year'] = np.nan
+    film['actors'] = []
+    film['directors'] = []
+    film['genres'] = []
+    film['themes'] = []
+    soup_movie = BeautifulSoup(content, 'html.parser')
+    for sc in soup_movie.findAll("script"):
+        if sc.string != None:
+            if "ratingValue" in sc.string:
+                film['avg_rating'] = sc.string.split("ratingValue")[1].split(",")[0][2:]
+            # if "releaseYear" in sc.string:
+            #     year = sc.string.split("releaseYear")[1].split(",")[0][2:].replace('"','')
+            if "startDate" in sc.string:
+                film['year'] = sc.string.split("startDate")[1].split(",")[0][3:7]
+    try:
+        film['runtime'] = int(soup_movie.find('p',{'class':'text-link text-footer'}).get_text().strip().split('\xa0')[0])
+    except:
+        film['runtime'] = np.nan
+
+    # finding the actors
+    if (soup_movie.find('div', {'class':'cast-list'}) != None):
+        for actor in soup_movie.find('div', {'class':'cast-list'}).findAll('a'):
+            if actor.get_text().strip() != 'Show All…':
+                film['actors'].append((actor.get_text().strip(), actor['href']))
+
+    # finding the directors
+    if (soup_movie.find('div', {'id':'tab-crew'}) != None):
+        for director in soup_movie.find('div', {'id':'tab-crew'}).find('div').findAll('a'):
+            film['directors'].append((director.get_text().strip(), director['href']))
+
+    # finding the genres
+    if (soup_movie.find('div', {'id':'tab-genres'}) != None):
+        for genre in soup_movie.find('div', {'id':'tab-genres'}).find('div').findAll('a'):
+            film['genres'].append(genre.get_text().strip())
+    
+    # finding the themes
+    if (soup_movie.find('div', {'id':'tab-genres'}) != None):
+        if ('Themes' in str(soup_movie.find('div', {'id':'tab-genres'}))):
+            for theme in soup_movie.find('div', {'id':'tab-genres'}).findAll('div')[1].findAll('a'):
+                if theme.get_text().strip() != 'Show All…':
+                    film['themes'].append(theme.get_text().strip())
+    return film
+
+def parse_film_stats(content):
+    """
+    extracts the number of members who watched and liked a movie from its stats fragment
+    :param: content: raw html of /csi<link>stats
+    :rtype: returns a tuple of watched_by and liked_by
+    """
+    soup_stats = BeautifulSoup(content, 'html.parser')
+    watched_by = int(soup_stats.findAll('a')[0]['title'].replace(u'\xa0', u' ').split(" ")[2].replace(u',', u''))
+    liked_by = int(soup_stats.findAll('a')[2]['title'].replace(u'\xa0', u' ').split(" ")[2].replace(u',', u''))
+    return watched_by, liked_by
+
+def scrape_films_details(df_film, username, max_workers=MAX_WORKERS, progress=None, on_error=None):
+    """
+    details of the rated movies, from the film store while they are fresh and scraped otherwise
+    :param: progress: called from the calling thread with the number of movies done and the total
+    :param: on_error: called with the ScrapeError of a film page or stats that failed, the movie keeps its
+                      stored details; the error is printed when None
+    :rtype: returns df_rating, df_actor, df_director, df_genre and df_theme
+    """
+    df_film = df_film[df_film['rating']!=-1].reset_index(drop=True)
+    movies_rating = {}
+    movies_rating['id'] = []
+    movies_rating['avg_rating'] = []
+    movies_rating['year'] = []
+    movies_rating['watched_by'] = []
+    movies_rating['liked_by'] = []
+    movies_rating['runtime'] = []
+    
+    movies_actor = {}
+    movies_actor['id'] = []
+    movies_actor['actor'] = []
+    movies_actor['actor_link'] = []
+    
+    movies_director = {}
+    movies_director['id'] = []
+    movies_director['director'] = []
+    movies_director['director_link'] = []
+    
+    movies_genre = {}
+    movies_genre['id'] = []
+    movies_genre['genre'] = []
+
+    movies_theme = {}
+    movies_theme['id'] = []
+    movies_theme['theme'] = []
+    if on_error is None:
+        on_error = print
+    done = 0
+    films = list(zip(df_film['id'], df_film['title'], df_film['link']))
+    # details already known and still fresh are served from the shared store
+    stored = film_store.load_films(df_film['id'])
+    scraped = {}
+    now = time.time()
+    lookahead = 2*max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the film page and its stats are requested together, and only a few
+        # films ahead of the parser so that responses don't pile up in memory
+        def submit(id_movie, link):
+            sources = film_store.stale_sources(stored.get(str(id_movie)), now)
+            return (executor.submit(single_flight, ('film', link), fetch_page, DOMAIN + link) if 'page' in sources else None,
+                    executor.submit(single_flight, ('stats', link), fetch_page, DOMAIN + "/csi" + link + "stats") if 'stats' in sources else None)
+        pending = deque(submit(id_movie, link) for id_movie, title, link in films[:lookahead])
+        for id_movie, title, link in films:
+            future_movie, future_stats = pending.popleft()
+            if done+lookahead < len(films):
+                pending.append(submit(films[done+lookahead][0], films[done+lookahead][2]))
+            done = done+1
+            print('scraping details of {} [{}]'.format(title, username))
+            
+            film = {'avg_rating': np.nan, 'year': np.nan, 'runtime': np.nan, 'watched_by': np.nan, 'liked_by': np.nan,
+                    'actors': [], 'directors': [], 'genres': [], 'themes': []}
+            film.update(stored.get(str(id_movie), {}))
+            fresh = {}
+            if future_movie is not None:
+                try:
+                    url_movie_page = future_movie.result()
+                    if url_movie_page.status_code != 200:
+                        raise ScrapeError(DOMAIN + link, url_movie_page.status_code)
+                except ScrapeError as e:
+                    on_error(e)
+                else:
+                    details = parse_film_page(url_movie_page.content)
+                    film.update(details)
+                    fresh.update(details)
+                    fresh['page_fetched_at'] = now
+            if future_stats is not None:
+                try:
+                    url_stats = future_stats.result()
+                    if url_stats.status_code != 200:
+                        raise ScrapeError(DOMAIN + "/csi" + link + "stats", url_stats.status_code)
+                except ScrapeError as e:
+                    on_error(e)
+                else:
+                    film['watched_by'], film['liked_by'] = parse_film_stats(url_stats.content)
+                    fresh['watched_by'], fresh['liked_by'] = film['watched_by'], film['liked_by']
+                    fresh['stats_fetched_at'] = now
+            if len(fresh) > 0:
+                scraped[id_movie] = fresh
+            movies_rating['id'].append(id_movie)
+            movies_rating['avg_rating'].append(film['avg_rating'])
+            movies_rating['year'].append(film['year'])
+            movies_rating['watched_by'].append(film['watched_by'])
+            movies_rating['liked_by'].append(film['liked_by'])
+            movies_rating['runtime'].append(film['runtime'])
+            for actor, actor_link in film['actors']:
+                movies_actor['id'].append(id_movie)
+                movies_actor['actor'].append(actor)
+                movies_actor['actor_link'].append(actor_link)
+            for director, director_link in film['directors']:
+                movies_director['id'].append(id_movie)
+                movies_director['director'].append(director)
+                movies_director['director_link'].append(director_link)
+            for genre in film['genres']:
+                movies_genre['id'].append(id_movie)
+                movies_genre['genre'].append(genre)
+            for theme in film['themes']:
+                movies_theme['id'].append(id_movie)
+                movies_theme['theme'].append(theme)
+            if progress is not None:
+                progress(done, len(df_film))
+    film_store.save_films(scraped)
+    df_rating = typed(pd.DataFrame(movies_rating))
+    df_rating['decade'] = decade_year(df_rating['year'])
+    df_actor = typed(pd.DataFrame(movies_actor))
+    df_director = typed(pd.DataFrame(movies_director))
+    df_genre = typed(pd.DataFrame(movies_genre))
+    df_theme = typed(pd.DataFrame(movies_theme))
+    return df_rating, df_actor, df_director, df_genre, df_theme
@@ -0,0 +1,246 @@
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+STORE_PATH = os.path.join('cache', 'films.db')
+DAY = 24*60*60
+# seconds before a request for a movie is made again. A request gives every field it holds at once, so a
+# field can't outlive the request it comes from: the film page (year, runtime, cast, crew, genres, themes)
+# follows the average rating, the most changing field on it; the stats follow watched_by and liked_by
+SOURCE_TTL = {
+    'page': 7*DAY,
+    'stats': 3*DAY,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS films (
+    id TEXT PRIMARY KEY,
+    avg_rating TEXT,
+    year TEXT,
+    runtime INTEGER,
+    watched_by INTEGER,
+    liked_by INTEGER,
+    page_fetched_at REAL,
+    stats_fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS film_actors (id TEXT, position INTEGER, actor TEXT, actor_link TEXT);
+CREATE TABLE IF NOT EXISTS film_directors (id TEXT, position INTEGER, director TEXT, director_link TEXT);
+CREATE TABLE IF NOT EXISTS film_genres (id TEXT, position INTEGER, genre TEXT);
+CREATE TABLE IF NOT EXISTS film_themes (id TEXT, position INTEGER, theme TEXT);
+CREATE TABLE IF NOT EXISTS user_films (username TEXT, position INTEGER, id TEXT, title TEXT, rating REAL, liked INTEGER, link TEXT);
+CREATE TABLE IF NOT EXISTS user_snapshots (username TEXT PRIMARY KEY, synced_at REAL);
+CREATE TABLE IF NOT EXISTS user_friends (username TEXT, direction TEXT, position INTEGER, friend TEXT);
+CREATE TABLE IF NOT EXISTS friend_snapshots (username TEXT, direction TEXT, synced_at REAL, PRIMARY KEY (username, direction));
+CREATE INDEX IF NOT EXISTS user_films_username ON user_films (username, position);
+CREATE INDEX IF NOT EXISTS user_friends_username ON user_friends (username, direction, position);
+CREATE INDEX IF NOT EXISTS film_actors_id ON film_actors (id);
+CREATE INDEX IF NOT EXISTS film_directors_id ON film_directors (id);
+CREATE INDEX IF NOT EXISTS film_genres_id ON film_genres (id);
+CREATE INDEX IF NOT EXISTS film_themes_id ON film_themes (id);
+"""
+
+def connect(path=STORE_PATH):
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _nan(value):
+    return np.nan if value is None else value
+
+def _null(value):
+    return None if (isinstance(value, float) and np.isnan(value)) else value
+
+def load_films(ids, path=STORE_PATH):
+    """
+    reads the stored details of the given movies
+    :param: ids: data-film-id of the movies
+    :rtype: returns a dict of film id to the details in the format of engine.parse_film_page,
+            plus watched_by, liked_by and the time each source was fetched
+    """
+    films = {}
+    ids = [str(i) for i in ids]
+    conn = connect(path)
+    try:
+        # sqlite limits the number of bound parameters, so query in chunks
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start+500]
+            marks = ",".join("?"*len(chunk))
+            for row in conn.execute("SELECT id, avg_rating, year, runtime, watched_by, liked_by, page_fetched_at, stats_fetched_at "
+                                    "FROM films WHERE id IN ({})".format(marks), chunk):
+                films[row[0]] = {
+                    'avg_rating': _nan(row[1]),
+                    'year': _nan(row[2]),
+                    'runtime': _nan(row[3]),
+                    'watched_by': row[4],
+                    'liked_by': row[5],
+                    'page_fetched_at': row[6],
+                    'stats_fetched_at': row[7],
+                    'actors': [],
+                    'directors': [],
+                    'genres': [],
+                    'themes': [],
+                }
+            for row in conn.execute("SELECT id, actor, actor_link FROM film_actors WHERE id IN ({}) ORDER BY id, position".format(marks), chunk):
+                films[row[0]]['actors'].append((row[1], row[2]))
+            for row in conn.execute("SELECT id, director, director_link FROM film_directors WHERE id IN ({}) ORDER BY id, position".format(marks), chunk):
+                films[row[0]]['directors'].append((row[1], row[2]))
+            for row in conn.execute("SELECT id, genre FROM film_genres WHERE id IN ({}) ORDER BY id, position".format(marks), chunk):
+                films[row[0]]['genres'].append(row[1])
+            for row in conn.execute("SELECT id, theme FROM film_themes WHERE id IN ({}) ORDER BY id, position".format(marks), chunk):
+                films[row[0]]['themes'].append(row[1])
+    finally:
+        conn.close()
+    return films
+
+def stale_sources(film, now=None):
+    """
+    :param: film: stored details of a movie, or None when it has never been scraped
+    :rtype: returns the set of requests ('page', 'stats') that have to be made again
+    """
+    if film is None:
+        return {'page', 'stats'}
+    if now is None:
+        now = time.time()
+    sources = set()
+    for source, ttl in SOURCE_TTL.items():
+        fetched_at = film[source+'_fetched_at']
+        if (fetched_at is None) or (now-fetched_at > ttl):
+            sources.add(source)
+    return sources
+
+def save_films(films, path=STORE_PATH):
+    """
+    upserts scraped details, only the sources that were fetched are overwritten
+    :param: films: dict of film id to details, with page_fetched_at/stats_fetched_at set for the fetched sources
+    """
+    if len(films) == 0:
+        return
+    conn = connect(path)
+    try:
+        with conn:
+            for id_movie, film in films.items():
+                id_movie = str(id_movie)
+                conn.execute("INSERT OR IGNORE INTO films (id) VALUES (?)", (id_movie,))
+                if film.get('page_fetched_at') is not None:
+                    conn.execute("UPDATE films SET avg_rating=?, year=?, runtime=?, page_fetched_at=? WHERE id=?",
+                                 (_null(film['avg_rating']), _null(film['year']), _null(film['runtime']),
+                                  film['page_fetched_at'], id_movie))
+                    for table in ['film_actors', 'film_directors', 'film_genres', 'film_themes']:
+                        conn.execute("DELETE FROM {} WHERE id=?".format(table), (id_movie,))
+                    conn.executemany("INSERT INTO film_actors VALUES (?, ?, ?, ?)",
+                                     [(id_movie, i, actor, actor_link) for i, (actor, actor_link) in enumerate(film['actors'])])
+                    conn.executemany("INSERT INTO film_directors VALUES (?, ?, ?, ?)",
+                                     [(id_movie, i, director, director_link) for i, (director, director_link) in enumerate(film['directors'])])
+                    conn.executemany("INSERT INTO film_genres VALUES (?, ?, ?)",
+                                     [(id_movie, i, genre) for i, genre in enumerate(film['genres'])])
+                    conn.executemany("INSERT INTO film_themes VALUES (?, ?, ?)",
+                                     [(id_movie, i, theme) for i, theme in enumerate(film['themes'])])
+                if film.get('stats_fetched_at') is not None:
+                    conn.execute("UPDATE films SET watched_by=?, liked_by=?, stats_fetched_at=? WHERE id=?",
+                                 (film['watched_by'], film['liked_by'], film['stats_fetched_at'], id_movie))
+    finally:
+        conn.close()
+
+def load_user_films(username, path=STORE_PATH):
+    """
+    reads the last stored film list of a user
+    :rtype: returns a tuple of the film list in the format of engine.scrape_films and the time of the
+            last full scrape, or (None, None) when the user has no snapshot
+    """
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT synced_at FROM user_snapshots WHERE username=?", (username,)).fetchone()
+        if row is None:
+            return None, None
+        df_film = pd.read_sql_query("SELECT id, title, rating, liked, link FROM user_films WHERE username=? ORDER BY position",
+                                    conn, params=(username,))
+    finally:
+        conn.close()
+    df_film['liked'] = df_film['liked'].astype(bool)
+    return df_film, row[0]
+
+def save_user_films(username, df_film, synced_at=None, path=STORE_PATH):
+    """
+    replaces the stored film list of a user
+    :param: synced_at: time of the last full scrape the list is based on, defaults to now
+    """
+    if synced_at is None:
+        synced_at = time.time()
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM user_films WHERE username=?", (username,))
+            conn.executemany("INSERT INTO user_films VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [(username, i, str(id_movie), title, float(rating), int(liked), link)
+                              for i, (id_movie, title, rating, liked, link) in enumerate(zip(df_film['id'], df_film['title'],
+                                                                                            df_film['rating'], df_film['liked'],
+                                                                                            df_film['link']))])
+            conn.execute("INSERT OR REPLACE INTO user_snapshots VALUES (?, ?)", (username, synced_at))
+    finally:
+        conn.close()
+
+def load_friends(username, direction, path=STORE_PATH):
+    """
+    reads the last stored friend list of a user
+    :param: direction: 'following' or 'followers'
+    :rtype: returns a tuple of the usernames and the time they were scraped, or (None, None) when never stored
+    """
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT synced_at FROM friend_snapshots WHERE username=? AND direction=?", (username, direction)).fetchone()
+        if row is None:
+            return None, None
+        friends = [friend for (friend,) in conn.execute("SELECT friend FROM user_friends WHERE username=? AND direction=? ORDER BY position",
+                                                        (username, direction))]
+    finally:
+        conn.close()
+    return friends, row[0]
+
+def save_friends(username, direction, friends, synced_at=None, path=STORE_PATH):
+    """
+    replaces the stored friend list of a user
+    :param: synced_at: time the list was scraped, defaults to now
+    """
+    if synced_at is None:
+        synced_at = time.time()
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM user_friends WHERE username=? AND direction=?", (username, direction))
+            conn.executemany("INSERT INTO user_friends VALUES (?, ?, ?, ?)",
+                             [(username, direction, i, friend) for i, friend in enumerate(friends)])
+            conn.execute("INSERT OR REPLACE INTO friend_snapshots VALUES (?, ?, ?)", (username, direction, synced_at))
+    finally:
+        conn.close()
+
+def prune(max_age, now=None, path=STORE_PATH):
+    """
+    deletes stored data that was not fetched again for too long
+    :param: max_age: seconds to keep 'films' (details of a film), 'user_films' (film list of a user) and 'friends' (friend list of a user)
+    :rtype: returns the number of films, users and friend lists deleted
+    """
+    if now is None:
+        now = time.time()
+    conn = connect(path)
+    try:
+        with conn:
+            # a film is as old as the most recent of its sources
+            ids = [(id_movie,) for (id_movie,) in conn.execute("SELECT id FROM films WHERE MAX(IFNULL(page_fetched_at, 0), IFNULL(stats_fetched_at, 0)) < ?",
+                                                                (now-max_age['films'],))]
+            conn.executemany("DELETE FROM films WHERE id=?", ids)
+            for table in ['film_actors', 'film_directors', 'film_genres', 'film_themes']:
+                conn.executemany("DELETE FROM {} WHERE id=?".format(table), ids)
+            users = [(username,) for (username,) in conn.execute("SELECT username FROM user_snapshots WHERE synced_at < ?", (now-max_age['user_films'],))]
+            conn.executemany("DELETE FROM user_films WHERE username=?", users)
+            conn.executemany("DELETE FROM user_snapshots WHERE username=?", users)
+            lists = conn.execute("SELECT username, direction FROM friend_snapshots WHERE synced_at < ?", (now-max_age['friends'],)).fetchall()
+            conn.executemany("DELETE FROM user_friends WHERE username=? AND direction=?", lists)
+            conn.executemany("DELETE FROM friend_snapshots WHERE username=? AND direction=?", lists)
+    finally:
+        conn.close()
+    return len(ids), len(users), len(lists)
@@ -0,0 +1,382 @@
+import os
+import sqlite3
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+import pandas as pd
+import result_store
+from engine import (scrape_films, scrape_films_details, list_friends, compare_friends, limit_friends, FriendsData,
+                    aggregate_recommendations, score_recommendations)
+
+JOB_DB_PATH = os.path.join('cache', 'jobs.db')
+# worker processes started with the app, 0 leaves the queue to workers started with `python jobs.py`
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count()))
+# jobs run at the same time by one worker process, they share its requests in flight and its caches
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 4))
+# seconds between two progress writes of a job
+PROGRESS_INTERVAL = 1.0
+# seconds between two heartbeats of a worker process
+HEARTBEAT_INTERVAL = 5.0
+# seconds without a heartbeat after which a worker is taken for dead and its running jobs are queued again
+JOB_STALE_AFTER = 30.0
+# seconds between two checks that the worker processes started with the app are alive
+SUPERVISE_INTERVAL = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT,
+    params TEXT,
+    snapshot TEXT,
+    status TEXT,
+    progress REAL,
+    message TEXT,
+    error TEXT,
+    worker INTEGER,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_snapshot ON jobs (snapshot);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS job_partials (job_id INTEGER PRIMARY KEY, partial TEXT);
+CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, heartbeat_at REAL);
+"""
+
+def connect(path=JOB_DB_PATH):
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # transactions are opened explicitly, so that submit and claim hold the write lock from their first read
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _job(row):
+    return {'id': row[0], 'kind': row[1], 'params': json.loads(row[2]), 'snapshot': row[3], 'status': row[4],
+            'progress': row[5], 'message': row[6], 'error': row[7]}
+
+def _requeue_stale(conn, now):
+    """
+    queues again the running jobs whose worker process is gone or hasn't sent a heartbeat for JOB_STALE_AFTER
+    seconds, in the transaction of the caller
+    :rtype: returns the number of jobs queued again
+    """
+    alive = {pid for (pid,) in conn.execute("SELECT pid FROM workers WHERE heartbeat_at >= ?", (now-JOB_STALE_AFTER,))}
+    stale = []
+    for job_id, worker in conn.execute("SELECT id, worker FROM jobs WHERE status='running'").fetchall():
+        if worker not in alive:
+            stale.append((job_id,))
+            continue
+        try:
+            os.kill(worker, 0)
+        except ProcessLookupError:
+            stale.append((job_id,))
+    conn.executemany("UPDATE jobs SET status='queued', worker=NULL, message='waiting for a worker' WHERE id=?", stale)
+    conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now-JOB_STALE_AFTER,))
+    return len(stale)
+
+def submit(kind, params, snapshot, retry=False, path=JOB_DB_PATH):
+    """
+    queues a job, unless one for the same snapshot is queued, running, or done with its frames still stored;
+    a running job whose worker is gone is queued again
+    :param: kind: one of JOB_KINDS
+    :param: params: keyword arguments of the job function
+    :param: snapshot: name the frames are saved under in the result store
+    :param: retry: queue the job again when the last one for the snapshot failed
+    :rtype: returns the job id
+    """
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _requeue_stale(conn, time.time())
+        row = conn.execute("SELECT id, status FROM jobs WHERE snapshot=? ORDER BY id DESC LIMIT 1", (snapshot,)).fetchone()
+        if row is not None:
+            job_id, status = row
+            if ((status in ['queued', 'running'])
+                    or ((status == 'done') and os.path.exists(result_store.snapshot_path(snapshot)))
+                    or ((status == 'failed') and not retry)):
+                conn.execute("COMMIT")
+                return job_id
+        job_id = conn.execute("INSERT INTO jobs (kind, params, snapshot, status, progress, message, created_at) VALUES (?, ?, ?, 'queued', 0, 'waiting for a worker', ?)",
+                              (kind, json.dumps(params), snapshot, time.time())).lastrowid
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return job_id
+
+def get(job_id, path=JOB_DB_PATH):
+    """
+    :rtype: returns the job as a dict (id, kind, params, snapshot, status, progress, message, error), None when unknown
+    """
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT id, kind, params, snapshot, status, progress, message, error FROM jobs WHERE id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return None if row is None else _job(row)
+
+def live_workers(path=JOB_DB_PATH):
+    """
+    :rtype: returns the number of worker processes that sent a heartbeat in the last JOB_STALE_AFTER seconds
+    """
+    conn = connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?", (time.time()-JOB_STALE_AFTER,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def claim(worker, path=JOB_DB_PATH):
+    """
+    marks the oldest queued job as running on the worker, after queueing again the jobs of workers that are gone
+    :param: worker: pid of the worker process
+    :rtype: returns the job, None when the queue is empty
+    """
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _requeue_stale(conn, time.time())
+        row = conn.execute("SELECT id, kind, params, snapshot, status, progress, message, error FROM jobs WHERE status='queued' ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status='running', worker=?, started_at=?, message='starting' WHERE id=?", (worker, time.time(), row[0]))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return None if row is None else _job(row)
+
+def update(job_id, progress, message, partial=None, path=JOB_DB_PATH):
+    """
+    :param: partial: results so far, anything json can write, e.g. the rows of the friends ranking
+    """
+    conn = connect(path)
+    try:
+        conn.execute("UPDATE jobs SET progress=?, message=? WHERE id=?", (progress, message, job_id))
+        if partial is not None:
+            conn.execute("INSERT OR REPLACE INTO job_partials VALUES (?, ?)", (job_id, json.dumps(partial)))
+    finally:
+        conn.close()
+
+def partial(job_id, path=JOB_DB_PATH):
+    """
+    :rtype: returns the last partial results of a running job, None when it has reported none
+    """
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT partial FROM job_partials WHERE job_id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return None if row is None else json.loads(row[0])
+
+def finish(job_id, error=None, path=JOB_DB_PATH):
+    """
+    marks the job as done, or as failed when there is an error
+    """
+    conn = connect(path)
+    try:
+        if error is None:
+            conn.execute("UPDATE jobs SET status='done', progress=1, message='done', finished_at=? WHERE id=?", (time.time(), job_id))
+        else:
+            conn.execute("UPDATE jobs SET status='failed', error=?, finished_at=? WHERE id=?", (error, time.time(), job_id))
+        # the frames are in the result store now
+        conn.execute("DELETE FROM job_partials WHERE job_id=?", (job_id,))
+    finally:
+        conn.close()
+
+def requeue_orphans(path=JOB_DB_PATH):
+    """
+    queues again the running jobs whose worker process is gone, see _requeue_stale
+    :rtype: returns the number of jobs queued again
+    """
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        n_orphans = _requeue_stale(conn, time.time())
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return n_orphans
+
+def beat(worker, path=JOB_DB_PATH):
+    """
+    tells the queue that the worker process is alive
+    """
+    conn = connect(path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO workers VALUES (?, ?)", (worker, time.time()))
+    finally:
+        conn.close()
+
+def heartbeat(worker, path=JOB_DB_PATH):
+    """
+    beats every HEARTBEAT_INTERVAL seconds, forever
+    """
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            beat(worker, path)
+        except sqlite3.OperationalError as e:
+            print("==== HEARTBEAT FAILED: {} ====".format(e))
+
+def profile_frames(username, report):
+    """
+    scrapes the rated movies of a user and their details
+    :param: report: called with the progress (0 to 1) and a message
+    :rtype: returns the frames of the profile snapshot
+    """
+    report(0, "scraping your movies")
+    df_film = scrape_films(username)
+    df_film = df_film[df_film['rating']!=-1].reset_index(drop=True)
+    report(0.1, "You have {0} movies to scrape".format(len(df_film)))
+    df_rating, df_actor, df_director, df_genre, df_theme = scrape_films_details(
+        df_film, username, progress=lambda done, total: report(0.1+0.9*done/total, "scraped details of {} of {} movies".format(done, total)))
+    return {'film': df_film, 'rating': df_rating, 'actor': df_actor,
+            'director': df_director, 'genre': df_genre, 'theme': df_theme}
+
+def friends_frames(username, ftype, report):
+    """
+    scrapes the friends of a user and scores all of them, whatever the limit
+    :param: report: called with the progress (0 to 1), a message and the ranking so far,
+                    a list of [username, no_of_movies, index_score] in the order the friends were scored
+    :rtype: returns the frames of the friends snapshot, errors holds the url and status of the friends' pages
+            that couldn't be scraped
+    """
+    report(0, "scraping your friends list")
+    friends_list = list_friends(username, ftype)
+    report(0.05, "You have {0} friends to scrape".format(len(friends_list)))
+    ranking = []
+    def on_friend(username_b, no_of_movies, index_score):
+        ranking.append([username_b, no_of_movies, index_score])
+        report(0.05+0.95*len(ranking)/len(friends_list), "scraped {} of {} friends".format(len(ranking), len(friends_list)), ranking)
+    errors = []
+    def on_error(e):
+        print(e)
+        errors.append(e)
+    df_friends, friends_films, df_a = compare_friends(username, friends_list, on_friend=on_friend, on_error=on_error)
+    return {'friends_list': pd.DataFrame({'username': friends_list}),
+            'friends': df_friends, 'films_a': df_a,
+            'friends_films': FriendsData(username, df_a, friends_films).to_frame(),
+            'errors': pd.DataFrame({'url': [e.url for e in errors], 'status_code': [e.status_code for e in errors]}, dtype='object')}
+
+def recommendation_frames(username, friends, limit, report):
+    """
+    recommends the movies of the friends who rated at least limit of the user's movies
+    :param: friends: snapshot of the user's friends, see friends_frames
+    :rtype: returns the frames of the recommendations snapshot
+    """
+    report(0, "recommending the movies of your friends")
+    df_a = result_store.load_frame(friends, 'films_a')
+    friends_films = FriendsData.from_frame(username, df_a, result_store.load_frame(friends, 'friends_films')).friends_films
+    df_friends, friends_data, df_a = limit_friends(username, result_store.load_frame(friends, 'friends'), friends_films, df_a, limit)
+    if len(df_friends) == 0:
+        # stored like any other result, so a batch doesn't run it again; the app warns before reading it
+        print("==== NONE OF THE FRIENDS OF {} HAS RATED AT LEAST {} OF THEIR MOVIES ====".format(username, limit))
+
+    # the aggregates are kept apart from the index so they can be re-weighted later
+    df_recom_agg = aggregate_recommendations(df_friends, friends_data, df_a)
+    df_recom = score_recommendations(df_recom_agg)
+    df_recom = df_recom.sort_values('index', ascending=False).reset_index(drop=True)
+    df_recom = df_recom[df_recom['no_of_rate'] > 1].reset_index(drop=True)
+    df_recom = df_recom.iloc[:100]
+
+    # the movies other limits recommended too are served from the film store
+    report(0.05, "scraping the recommended movies")
+    df_rating_recom, df_actor_recom, df_director_recom, df_genre_recom, df_theme_recom = scrape_films_details(
+        df_recom, username, progress=lambda done, total: report(0.05+0.95*done/total, "scraped {} of {} recommended movies".format(done, total)))
+    df_recom_details = pd.merge(df_rating_recom, df_genre_recom, left_on='id', right_on='id')
+    df_recom_details['genre'] = df_recom_details.groupby(['id'])['genre'].transform(lambda x: '|'.join(x))
+    df_recom_details = df_recom_details.drop_duplicates().reset_index(drop=True)
+    return {'recom_agg': df_recom_agg, 'recom_details': df_recom_details}
+
+# the function each kind of job runs, it returns the frames saved to the result store
+JOB_KINDS = {
+    'profile': profile_frames,
+    'friends': friends_frames,
+    'recommendations': recommendation_frames,
+}
+
+def run(job, path=JOB_DB_PATH):
+    """
+    runs a claimed job and saves its frames under the job's snapshot
+    """
+    last = [0.0]
+    def report(progress, message, partial=None):
+        # a job reports on every movie or friend, the database is only written once per PROGRESS_INTERVAL
+        now = time.time()
+        if now-last[0] >= PROGRESS_INTERVAL:
+            last[0] = now
+            update(job['id'], progress, message, partial, path)
+    print('==== JOB {} {} {} ===='.format(job['id'], job['kind'], job['params']))
+    try:
+        frames = JOB_KINDS[job['kind']](report=report, **job['params'])
+        result_store.save_frames(job['snapshot'], frames)
+    except Exception as e:
+        traceback.print_exc()
+        finish(job['id'], "{}: {}".format(type(e).__name__, e), path)
+    else:
+        finish(job['id'], path=path)
+
+def work_loop(path=JOB_DB_PATH, poll_interval=1.0):
+    """
+    runs queued jobs one after the other, forever
+    """
+    while True:
+        job = claim(os.getpid(), path)
+        if job is None:
+            time.sleep(poll_interval)
+        else:
+            run(job, path)
+
+def work(path=JOB_DB_PATH, threads=JOB_THREADS):
+    """
+    runs queued jobs on the given number of threads of the worker process
+    """
+    # the first beat is in before any job is claimed, so no other process takes them for orphans
+    beat(os.getpid(), path)
+    threading.Thread(target=heartbeat, args=(os.getpid(), path), name='job-heartbeat', daemon=True).start()
+    loops = [threading.Thread(target=work_loop, args=(path,), name='job-{}'.format(i), daemon=True) for i in range(threads)]
+    for loop in loops:
+        loop.start()
+    for loop in loops:
+        loop.join()
+
+def start_worker(i, threads=JOB_THREADS, path=JOB_DB_PATH):
+    # spawned rather than forked, the workers don't inherit the threads of the web server
+    worker = multiprocessing.get_context('spawn').Process(target=work, args=(path, threads), name='job-worker-{}'.format(i), daemon=True)
+    worker.start()
+    return worker
+
+def supervise(workers, threads=JOB_THREADS, path=JOB_DB_PATH):
+    """
+    restarts the worker processes that died, e.g. killed for memory, and queues their jobs again, forever
+    :param: workers: the processes of start_workers, replaced in place
+    """
+    while True:
+        time.sleep(SUPERVISE_INTERVAL)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                print("==== JOB WORKER {} EXITED WITH {}, RESTARTING ====".format(worker.pid, worker.exitcode))
+                requeue_orphans(path)
+                workers[i] = start_worker(i, threads, path)
+
+def start_workers(n=JOB_WORKERS, threads=JOB_THREADS, path=JOB_DB_PATH):
+    """
+    starts n worker processes of the given number of threads, after queueing again the jobs of workers that are gone,
+    and a thread that restarts them when they die
+    :rtype: returns the processes
+    """
+    requeue_orphans(path)
+    workers = [start_worker(i, threads, path) for i in range(n)]
+    if n > 0:
+        threading.Thread(target=supervise, args=(workers, threads, path), name='job-supervisor', daemon=True).start()
+    return workers
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='runs the scrape jobs submitted by the app')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads', type=int, default=JOB_THREADS)
+    args = parser.parse_args()
+    requeue_orphans()
+    supervise([start_worker(i, args.threads) for i in range(args.workers)], args.threads)
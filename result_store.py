@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STORE_PATH = 'log'
+# prefix of the directories a snapshot is written in before it is renamed into place
+TEMP_PREFIX = '.tmp_'
+
+def snapshot_path(snapshot, path=STORE_PATH):
+    """
+    :param: snapshot: name of the analysis, e.g. "<date>_<username>"
+    :rtype: returns the directory that holds the frames of the snapshot
+    """
+    return os.path.join(path, snapshot)
+
+def profile_snapshot(day, username):
+    """
+    :param: day: date of the analysis
+    :rtype: returns the snapshot name of a profile analysis
+    """
+    return "{0}_{1}".format(str(day), username)
+
+def friends_snapshot(day, username, ftype):
+    """
+    :rtype: returns the snapshot name of the scores of all the friends of a user, see profile_snapshot
+    """
+    return "{0}_{1}_{2}_friends".format(str(day), username, ftype)
+
+def recommendations_snapshot(day, username, ftype, limit):
+    """
+    :rtype: returns the snapshot name of the movie recommendations of the friends kept by limit, see profile_snapshot
+    """
+    return "{0}_{1}_{2}_{3}".format(str(day), username, ftype, str(limit))
+
+def save_frames(snapshot, frames, path=STORE_PATH):
+    """
+    writes every frame of a snapshot to its own parquet file, <path>/<snapshot>/<name>.parquet
+    :param: frames: dict of name to DataFrame
+    """
+    directory = snapshot_path(snapshot, path)
+    os.makedirs(path, exist_ok=True)
+    # written next to the target and renamed once every frame is in, so a snapshot that exists is complete
+    temp_directory = tempfile.mkdtemp(prefix=TEMP_PREFIX+snapshot+'_', dir=path)
+    try:
+        for name, df in frames.items():
+            pq.write_table(pa.Table.from_pandas(df), os.path.join(temp_directory, name+'.parquet'))
+        old_directory = None
+        if os.path.exists(directory):
+            # e.g. run again with --force, a directory only replaces an empty one
+            old_directory = tempfile.mkdtemp(prefix=TEMP_PREFIX+snapshot+'_', dir=path)
+            os.replace(directory, old_directory)
+        os.replace(temp_directory, directory)
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+    if old_directory is not None:
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+def is_temporary(name):
+    """
+    :rtype: returns whether an entry of the store is a snapshot being written rather than a snapshot
+    """
+    return name.startswith(TEMP_PREFIX)
+
+def load_frame(snapshot, name, columns=None, path=STORE_PATH):
+    """
+    reads one frame of a snapshot through a memory map, dtypes (categories, nullable integers) are kept
+    :param: columns: only read these columns, all of them by default
+    :rtype: returns the DataFrame
+    """
+    file_path = os.path.join(snapshot_path(snapshot, path), name+'.parquet')
+    return pq.read_table(file_path, columns=columns, memory_map=True).to_pandas()
@@ -0,0 +1,161 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import atexit
+
+RUN_LOG_PATH = os.path.join('cache', 'runs.db')
+# columns of every log, the rows are written in this order
+RUN_TABLES = {
+    'log_detail': ['date', 'username'],
+    'log': ['date', 'username', 'ftype', 'limit'],
+    'mbti': ['username', 'mbti', 'genre', 'score'],
+    'mbti_theme': ['username', 'mbti', 'theme', 'score'],
+}
+# columns a row is looked up by
+RUN_KEYS = {
+    'log_detail': ['date', 'username'],
+    'log': ['date', 'username', 'ftype', 'limit'],
+    'mbti': ['username', 'mbti', 'genre'],
+    'mbti_theme': ['username', 'mbti', 'theme'],
+}
+
+class SQLiteBackend:
+    """
+    keeps the logs in a local sqlite database, with an index on the lookup columns of every table
+    """
+    def __init__(self, path=RUN_LOG_PATH):
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        conn = self.connect()
+        try:
+            for table, columns in RUN_TABLES.items():
+                conn.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(table, ", ".join('"{}" TEXT'.format(c) for c in columns)))
+                conn.execute('CREATE INDEX IF NOT EXISTS "{0}_key" ON "{0}" ({1})'.format(table, ", ".join('"{}"'.format(c) for c in RUN_KEYS[table])))
+        finally:
+            conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def append(self, table, rows):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany('INSERT INTO "{}" VALUES ({})'.format(table, ",".join("?"*len(RUN_TABLES[table]))),
+                                 [[str(value) for value in row] for row in rows])
+        finally:
+            conn.close()
+
+    def exists(self, table, key):
+        conn = self.connect()
+        try:
+            where = " AND ".join('"{}"=?'.format(c) for c in RUN_KEYS[table])
+            row = conn.execute('SELECT 1 FROM "{}" WHERE {} LIMIT 1'.format(table, where), [str(value) for value in key]).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+class SheetsBackend:
+    """
+    appends the logs to the sheets of a google spreadsheet, one sheet per table
+    :param: get_sheet: returns the spreadsheets resource of the sheets client, only called on the first request
+    """
+    def __init__(self, get_sheet, spreadsheet_id):
+        self.get_sheet = get_sheet
+        self.spreadsheet_id = spreadsheet_id
+
+    def append(self, table, rows):
+        self.get_sheet().values().append(spreadsheetId=self.spreadsheet_id,
+                                   range='{}!A:AA'.format(table),
+                                   valueInputOption='RAW',
+                                   insertDataOption='INSERT_ROWS',
+                                   body=dict(majorDimension='ROWS', values=[list(row) for row in rows])).execute()
+
+    def exists(self, table, key):
+        values = self.get_sheet().values().get(spreadsheetId=self.spreadsheet_id, range='{}!A:AA'.format(table)).execute().get('values', [])
+        if len(values) == 0:
+            return False
+        positions = [values[0].index(c) for c in RUN_KEYS[table]]
+        key = [str(value) for value in key]
+        return any([row[i] if i < len(row) else '' for i in positions] == key for row in values[1:])
+
+class RunLog:
+    """
+    records runs on every backend from a background thread, rows queued within flush_interval seconds are
+    written together. Lookups go to the first backend and also see the rows that are still queued.
+    """
+    def __init__(self, backends, flush_interval=2.0):
+        self.backends = backends
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = []
+        self._failed = {i: [] for i in range(len(backends))}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='run-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, table, row):
+        """
+        :param: row: values in the order of RUN_TABLES[table]
+        """
+        with self._lock:
+            self._pending.append((table, list(row)))
+        self._queue.put((table, list(row)))
+        self._wake.set()
+
+    def exists(self, table, key):
+        """
+        :param: key: values in the order of RUN_KEYS[table]
+        :rtype: returns whether a row with this key was recorded
+        """
+        positions = [RUN_TABLES[table].index(c) for c in RUN_KEYS[table]]
+        key = [str(value) for value in key]
+        with self._lock:
+            for pending_table, row in self._pending:
+                if (pending_table == table) and ([str(row[i]) for i in positions] == key):
+                    return True
+        return self.backends[0].exists(table, key)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # let the other rows of the same run arrive, to write them in one go
+            time.sleep(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        for i, backend in enumerate(self.backends):
+            # rows a backend failed to take before are retried with the next batch
+            rows = self._failed[i]+batch
+            self._failed[i] = []
+            tables = {}
+            for table, row in rows:
+                tables.setdefault(table, []).append(row)
+            for table, table_rows in tables.items():
+                try:
+                    backend.append(table, table_rows)
+                except Exception as e:
+                    print("==== RUN LOG {} FAILED ON {}: {} ====".format(type(backend).__name__, table, e))
+                    self._failed[i].extend((table, row) for row in table_rows)
+        with self._lock:
+            for item in batch:
+                self._pending.remove(item)
@@ -0,0 +1,99 @@
+import warnings
+import numpy as np
+import pandas as pd
+import analysis
+
+def billing_weights_loop(df_actor):
+    # the per-movie scan billing_weights replaced in the actor ranking
+    list_weights = []
+    movie_ids = df_actor['id'].unique()
+    for movie_id in movie_ids:
+        n_actor = df_actor.loc[df_actor['id']==movie_id].shape[0]
+        for i in range(n_actor):
+            weight = 1-i/n_actor
+            list_weights.append(weight)
+    return list_weights
+
+def cast(rng, n_movies):
+    """
+    :rtype: returns df_actor with 1 to 60 billed actors per movie, the rows of a movie together as they are scraped
+    """
+    n_actors = rng.integers(1, 61, n_movies)
+    return pd.DataFrame({'id': np.repeat(rng.permutation(100000)[:n_movies], n_actors),
+                         'actor': ['actor {}'.format(i) for i in rng.integers(0, 5000, n_actors.sum())]})
+
+def test_billing_weights_matches_loop():
+    rng = np.random.default_rng(0)
+    df_actor = cast(rng, 300)
+    weights = analysis.billing_weights(df_actor)
+    assert weights.index.equals(df_actor.index)
+    assert np.array_equal(weights.to_numpy(), billing_weights_loop(df_actor))
+    # a movie with a single actor, and no cast at all
+    assert analysis.billing_weights(pd.DataFrame({'id': [1], 'actor': ['a']})).tolist() == [1.0]
+    assert len(analysis.billing_weights(pd.DataFrame({'id': [], 'actor': []}))) == 0
+
+def genre_combinations_loop(df_genre_merged, genres, size=2):
+    # the nested loop genre_combinations replaced in the profile view, and the same scan over triples
+    df_genre_combination = pd.DataFrame(columns=df_genre_merged.columns)
+    for i in range(len(genres)):
+        for j in range(i+1, len(genres)):
+            if size == 2:
+                df_ha = df_genre_merged[(df_genre_merged['genre'] == genres[i]) | (df_genre_merged['genre'] == genres[j])]
+                if len(df_ha) != 0:
+                    df_ha['genre'] = genres[i] + " & " + genres[j]
+                    df_ha = df_ha[df_ha.duplicated('id')]
+                    df_genre_combination = pd.concat([df_genre_combination, df_ha]).reset_index(drop=True)
+                continue
+            for k in range(j+1, len(genres)):
+                df_ha = df_genre_merged[df_genre_merged['genre'].isin([genres[i], genres[j], genres[k]])]
+                if len(df_ha) != 0:
+                    df_ha['genre'] = genres[i] + " & " + genres[j] + " & " + genres[k]
+                    # the third row of a movie that has all three
+                    df_ha = df_ha[df_ha.groupby('id').cumcount() == 2]
+                    df_genre_combination = pd.concat([df_genre_combination, df_ha]).reset_index(drop=True)
+
+    df_temp_comb = df_genre_combination['genre'].value_counts().reset_index()
+    df_genre_combination['rating'] = df_genre_combination['rating'].astype(float)
+    df_genre_combination['liked'] = df_genre_combination['liked'].astype(int)
+    df_temp_comb_2 = df_genre_combination.groupby(['genre']).agg({'liked':'sum', 'rating':'mean'})
+    df_genre_combination['liked'] = df_genre_combination['liked'].astype(bool)
+    df_temp_comb_2 = df_temp_comb_2.reset_index()
+
+    df_temp_comb = pd.merge(df_temp_comb_2, df_temp_comb, left_on='genre', right_on='genre')
+    df_temp_comb = df_temp_comb.sort_values('count', ascending=False).reset_index(drop=True)
+    return df_genre_combination, df_temp_comb
+
+def genre_profile(rng, n_movies, genres):
+    """
+    :rtype: returns df_genre_merged as the profile view builds it, df_film merged with 1 to 4 genres per movie
+    """
+    n_genres = rng.integers(1, 5, n_movies)
+    df_film = pd.DataFrame({'id': np.arange(n_movies, dtype='int32'),
+                            'title': ['film {}'.format(i) for i in range(n_movies)],
+                            'rating': rng.choice(np.arange(1, 11)/2, n_movies).astype('float32'),
+                            'liked': rng.random(n_movies) < 0.3})
+    df_genre = pd.DataFrame({'id': np.repeat(df_film['id'], n_genres),
+                             'genre': np.concatenate([rng.choice(genres, n, replace=False) for n in n_genres])}).astype({'genre': 'category'})
+    return pd.merge(df_film, df_genre, left_on='id', right_on='id')
+
+def test_genre_combinations_matches_loop():
+    genres = ['Drama', 'Comedy', 'Thriller', 'Horror', 'Romance', 'Crime', 'Action', 'Documentary']
+    ties = 0
+    for seed, n_movies, size in [(0, 40, 2), (1, 300, 2), (2, 2000, 2), (3, 40, 3), (4, 300, 3)]:
+        rng = np.random.default_rng(seed)
+        df_genre_merged = genre_profile(rng, n_movies, genres)
+        # the top genres in the order of the chart, one of them on no movie
+        top = df_genre_merged['genre'].value_counts().index.tolist()[:6]+['Western']
+        df_genre_combination, df_temp_comb = analysis.genre_combinations(df_genre_merged, top, size)
+        with warnings.catch_warnings():
+            # the loop assigns to slices, as it did in the app
+            warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+            expected_combination, expected_comb = genre_combinations_loop(df_genre_merged, top, size)
+        # the order after the count sort depends on the order before it, tied counts show it
+        pd.testing.assert_frame_equal(df_temp_comb, expected_comb)
+        ties += df_temp_comb['count'].duplicated().sum()
+        columns = ['id', 'genre', 'rating', 'liked']
+        pd.testing.assert_frame_equal(df_genre_combination[columns].sort_values(['genre', 'id']).reset_index(drop=True),
+                                      expected_combination[columns].sort_values(['genre', 'id']).reset_index(drop=True),
+                                      check_dtype=False)
+    assert ties > 0
@@ -0,0 +1,70 @@
+import os
+import time
+import shutil
+import pandas as pd
+import cache_manager
+import result_store
+
+def save(path, snapshot, mtime=None):
+    result_store.save_frames(snapshot, {'film': pd.DataFrame({'id': range(1000)})}, path=path)
+    if mtime is not None:
+        os.utime(os.path.join(path, snapshot), (mtime, mtime))
+    return cache_manager._size(os.path.join(path, snapshot))
+
+def manager(monkeypatch, path, budget, clock):
+    # no sweeper thread, the test sweeps, and the clock only moves when the test moves it
+    monkeypatch.setattr(cache_manager.CacheManager, '_run', lambda self: None)
+    monkeypatch.setattr(cache_manager.time, 'time', lambda: clock[0])
+    return cache_manager.CacheManager(path=path, budget=budget)
+
+def test_least_recently_used_is_evicted_over_budget(monkeypatch, tmp_path):
+    path = str(tmp_path)
+    clock = [time.time()]
+    size = save(path, 'a')
+    cache = manager(monkeypatch, path, 2.5*size, clock)
+    cache.add('a', 'profile')
+    clock[0] += 1
+    save(path, 'b')
+    cache.add('b', 'profile')
+    clock[0] += 1
+    assert cache.lookup('a')
+    clock[0] += 1
+    save(path, 'c')
+    cache.add('c', 'profile')
+    assert sorted(os.listdir(path)) == ['a', 'c']
+    assert not cache.lookup('b')
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'snapshots': 2, 'bytes': 2*size}
+
+def test_expired_snapshot_is_a_miss_and_removed(monkeypatch, tmp_path):
+    path = str(tmp_path)
+    clock = [time.time()]
+    save(path, 'a')
+    cache = manager(monkeypatch, path, cache_manager.CACHE_BUDGET, clock)
+    cache.add('a', 'friends')
+    clock[0] += cache_manager.ARTIFACT_TTL['friends']-1
+    assert cache.lookup('a')
+    clock[0] += cache_manager.ARTIFACT_TTL['friends']+1
+    assert not cache.lookup('a')
+    cache.sweep()
+    assert os.listdir(path) == []
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'snapshots': 0, 'bytes': 0}
+
+def test_sweep_counts_snapshots_of_other_processes(monkeypatch, tmp_path):
+    path = str(tmp_path)
+    clock = [time.time()]
+    cache = manager(monkeypatch, path, cache_manager.CACHE_BUDGET, clock)
+    # written by the batch CLI after the manager started, never looked up
+    size = save(path, 'a', mtime=clock[0]-20)
+    save(path, 'b', mtime=clock[0]-10)
+    # a save killed a day ago and one in progress
+    os.makedirs(os.path.join(path, result_store.TEMP_PREFIX+'x'))
+    os.utime(os.path.join(path, result_store.TEMP_PREFIX+'x'), (clock[0]-2*cache_manager.DAY,)*2)
+    os.makedirs(os.path.join(path, result_store.TEMP_PREFIX+'y'))
+    cache.budget = 1.5*size
+    cache.sweep()
+    assert sorted(os.listdir(path)) == [result_store.TEMP_PREFIX+'y', 'b']
+    assert cache.stats()['snapshots'] == 1
+    # removed by another process
+    shutil.rmtree(os.path.join(path, 'b'))
+    cache.sweep()
+    assert cache.stats()['snapshots'] == 0
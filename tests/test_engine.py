@@ -0,0 +1,277 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+import engine
+
+RATINGS = np.arange(1, 11)/2
+
+def random_films(rng, n, ids):
+    """
+    :rtype: returns n rated movies picked among ids, in the format of engine.scrape_films
+    """
+    id_movies = rng.choice(ids, size=n, replace=False)
+    return engine.typed(pd.DataFrame({'id': id_movies,
+                                      'title': ['film {}'.format(i) for i in id_movies],
+                                      'rating': rng.choice(RATINGS, size=n),
+                                      'liked': rng.random(n) < 0.3,
+                                      'link': ['/film/{}/'.format(i) for i in id_movies]}))
+
+def test_aggregate_recommendations_with_no_friend_kept():
+    rng = np.random.default_rng(5)
+    df_a = random_films(rng, 50, np.arange(100))
+    friends_films = {'b': random_films(rng, 50, np.arange(100))}
+    df_friends, friends_data, df_a = engine.limit_friends('a', engine.batch_similarity(df_a, friends_films), friends_films, df_a, limit=1000)
+    df_recom = engine.score_recommendations(engine.aggregate_recommendations(df_friends, friends_data, df_a))
+    assert len(df_recom) == 0
+    assert df_recom.columns.tolist() == ['id', 'title', 'link', 'rating', 'liked', 'friends_score', 'no_of_rate', 'index']
+
+def test_score_index_array_matches_score_index():
+    rng = np.random.default_rng(0)
+    n = 10000
+    rating_x = rng.choice(RATINGS, size=n)
+    rating_y = np.where(rng.random(n) < 0.3, rating_x, rng.choice(RATINGS, size=n))
+    liked_x = rng.random(n) < 0.5
+    liked_y = rng.random(n) < 0.5
+    expected = np.array([engine.score_index(*row) for row in zip(rating_x, liked_x, rating_y, liked_y)])
+    assert np.array_equal(engine.score_index_array(rating_x, liked_x, rating_y, liked_y), expected)
+
+def test_compare_ratings_friends_index_matches_row_by_row():
+    rng = np.random.default_rng(1)
+    for n_a, n_b in [(300, 200), (50, 400), (0, 10)]:
+        df_a = random_films(rng, n_a, np.arange(1000))
+        df_b = random_films(rng, n_b, np.arange(1000))
+        index = engine.compare_ratings_friends('a', df_a, 'b', df_b)[3]
+        # the index as computed before score_index_array, one row at a time
+        df_merge = pd.merge(df_a, df_b, on=['id', 'title'])
+        expected = 0
+        if len(df_merge) > 0:
+            expected = df_merge.apply(lambda row: engine.score_index(row['rating_x'], row['liked_x'],
+                                                                     row['rating_y'], row['liked_y']), axis=1).sum()/(2*len(df_merge))
+        assert index == expected
+
+def test_batch_similarity_matches_compare_ratings_friends():
+    rng = np.random.default_rng(2)
+    df_a = random_films(rng, 300, np.arange(1000))
+    friends_films = {'friend{}'.format(i): random_films(rng, n, np.arange(1000)) for i, n in enumerate([0, 5, 200, 600])}
+    df_friends = engine.batch_similarity(df_a, friends_films)
+    assert df_friends['username'].tolist() == list(friends_films)
+    for username_b, df_b in friends_films.items():
+        row = df_friends[df_friends['username'] == username_b].iloc[0]
+        assert row['no_of_movies'] == len(pd.merge(df_a, df_b, on='id'))
+        assert np.isclose(row['index_score'], engine.compare_ratings_friends('a', df_a, username_b, df_b)[3])
+        assert np.isclose(row['total_index'], row['index_score']*row['no_of_movies'])
+
+def test_batch_similarity_counts_duplicate_movies_once():
+    rng = np.random.default_rng(3)
+    df_a = random_films(rng, 100, np.arange(200))
+    df_b = random_films(rng, 100, np.arange(200))
+    expected = engine.batch_similarity(df_a, {'b': df_b})
+    df_friends = engine.batch_similarity(pd.concat([df_a, df_a.iloc[:10]], ignore_index=True),
+                                         {'b': pd.concat([df_b, df_b.iloc[:10]], ignore_index=True)})
+    pd.testing.assert_frame_equal(df_friends, expected)
+
+class Page:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+def grid_page(films, next_page):
+    """
+    :param: films: (id, rating, liked) of the movies on the page
+    :rtype: returns a /films/ grid page as engine.parse_films_page reads it
+    """
+    stars = {value: key for key, value in engine.STARS.items()}
+    items = ''.join('<li><div data-film-id="{0}" data-target-link="/film/{0}/"><img alt="film {0}"></div>'
+                    '<p class="poster-viewingdata">{1}</p>{2}</li>'.format(id_movie, stars[rating], '<span class="like"></span>' if liked else '')
+                    for id_movie, rating, liked in films)
+    return Page('<ul class="grid">{}</ul>{}'.format(items, '<a class="next" href="#">next</a>' if next_page else ''))
+
+class Scraper:
+    """
+    a cloudscraper session that answers with the given responses in turn, an exception is raised instead of returned
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.timeouts = []
+
+    def get(self, url, timeout=None):
+        self.timeouts.append(timeout)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def scrapers(monkeypatch, *sessions):
+    # the sessions the process has, none is created
+    monkeypatch.setattr(engine, '_scrapers', queue.LifoQueue())
+    for scraper in sessions:
+        engine.put_scraper(scraper)
+
+def test_fetch_page_retries_connection_errors(monkeypatch):
+    monkeypatch.setattr(engine, '_request_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(engine.time, 'sleep', lambda seconds: None)
+    scraper = Scraper([requests.ConnectionError('reset'), requests.Timeout('stalled'), Page('ok')])
+    scrapers(monkeypatch, scraper)
+    assert engine.fetch_page('https://letterboxd.com/a/films/').content == 'ok'
+    assert scraper.timeouts == [engine.REQUEST_TIMEOUT]*3
+
+    # after the last attempt the page is skipped like any other that failed
+    scraper = Scraper([requests.ConnectionError('reset')]*(engine.MAX_RETRIES+1))
+    scrapers(monkeypatch, scraper)
+    with pytest.raises(engine.ScrapeError) as error:
+        engine.fetch_page('https://letterboxd.com/a/films/')
+    assert error.value.status_code is None
+    assert len(scraper.responses) == 0
+
+def test_fetch_page_reuses_sessions_across_pools(monkeypatch):
+    monkeypatch.setattr(engine, '_request_slots', threading.BoundedSemaphore(4))
+    scrapers(monkeypatch)
+    created = []
+    def create_scraper():
+        created.append(Scraper([Page('ok')]*100))
+        return created[-1]
+    monkeypatch.setattr(engine.cloudscraper, 'create_scraper', create_scraper)
+    # one pool per profile, as fetch_films opens them
+    for i in range(5):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert all(page.content == 'ok' for page in executor.map(engine.fetch_page, ['url']*20))
+    assert len(created) <= 4
+    assert sum(len(scraper.timeouts) for scraper in created) == 100
+
+def test_refresh_films_merges_new_and_changed_movies(monkeypatch):
+    df_snapshot = engine.typed(pd.DataFrame({'id': [3, 2, 1], 'title': ['film 3', 'film 2', 'film 1'], 'rating': [4.0, 3.0, 2.5],
+                                             'liked': [False, False, True], 'link': ['/film/3/', '/film/2/', '/film/1/']}))
+    # most recent first: two new movies, one of them pushed onto the second page while it was read, then a changed rating
+    pages = {engine.DOMAIN+'/a'+engine.RECENT_PATH: grid_page([(5, 5.0, True), (4, 1.0, False)], True),
+             engine.DOMAIN+'/a'+engine.RECENT_PATH+'page/2/': grid_page([(4, 1.0, False), (3, 4.5, True), (2, 3.0, False)], True)}
+    monkeypatch.setattr(engine, 'fetch_ok', lambda url: pages[url])
+    df_film = engine.refresh_films('a', df_snapshot)
+    assert df_film['id'].tolist() == [5, 4, 3, 2, 1]
+    assert df_film['rating'].tolist() == [5.0, 1.0, 4.5, 3.0, 2.5]
+    assert df_film['liked'].tolist() == [True, False, True, False, True]
+
+def test_scrape_films_shares_a_full_scrape_only(monkeypatch):
+    calls = []
+    def fetch_films(username, max_workers, incremental):
+        calls.append(incremental)
+        return pd.DataFrame({'scraped': [True]}), []
+    monkeypatch.setattr(engine, 'fetch_films', fetch_films)
+    error = engine.ScrapeError(engine.DOMAIN+'/a/films/page/2', 500)
+
+    def in_flight(key):
+        # a scrape another thread is running, it gives back a list with a missing page
+        future = engine.Future()
+        future.set_result((pd.DataFrame({'scraped': [False]}), [error]))
+        monkeypatch.setitem(engine._in_flight, key, future)
+
+    # a refresh joins a full scrape, and hears about the page it left out
+    in_flight(('films', 'a', False))
+    errors = []
+    assert not engine.scrape_films('a', incremental=True, on_error=errors.append)['scraped'].iloc[0]
+    assert errors == [error]
+    assert calls == []
+    monkeypatch.delitem(engine._in_flight, ('films', 'a', False))
+
+    # a full scrape never takes the result of a refresh
+    in_flight(('films', 'a', True))
+    assert engine.scrape_films('a', on_error=errors.append)['scraped'].iloc[0]
+    assert calls == [False]
+    errors.clear()
+    assert not engine.scrape_films('a', incremental=True, on_error=errors.append)['scraped'].iloc[0]
+    assert errors == [error]
+
+# the per-value functions the vectorized ones replaced, with their thresholds written out rather than read from engine
+def classify_popularity(watched_by):
+    if (watched_by <= 10000):
+        return "1 - very obscure"
+    elif (watched_by <= 100000):
+        return "2 - obscure"
+    elif (watched_by <= 1000000):
+        return "3 - popular"
+    else:
+        return "4 - very popular"
+
+def classify_likeability(ltw_ratio):
+    if (ltw_ratio <= 0.1):
+        return "1 - rarely likeable"
+    elif (ltw_ratio <= 0.2):
+        return "2 - sometimes likeable"
+    elif (ltw_ratio <= 0.4):
+        return "3 - often likeable"
+    else:
+        return "4 - usually likeable"
+
+def classify_runtime(runtime):
+    if (pd.isnull(runtime)!=True):
+        if (runtime < 30):
+            return "less than 30m"
+        elif (runtime < 60):
+            return "30m-1h"
+        elif (runtime < 90):
+            return "1h-1h 30m"
+        elif (runtime < 120):
+            return "1h 30m-2h"
+        elif (runtime < 150):
+            return "2h-2h 30m"
+        elif (runtime < 180):
+            return "2h 30m-3h"
+        else:
+            return "at least 3h"
+    else:
+        return np.nan
+
+def decade_year(year):
+    return str(int(year/10)*10)+"s"
+
+def transform_rating(some_str):
+    stars = {
+        "★": 1,
+        "★★": 2,
+        "★★★": 3,
+        "★★★★": 4,
+        "★★★★★": 5,
+        "½": 0.5,
+        "★½": 1.5,
+        "★★½": 2.5,
+        "★★★½": 3.5,
+        "★★★★½": 4.5
+    }
+    try:
+        return stars[some_str]
+    except:
+        return -1
+
+def as_list(series):
+    return [np.nan if pd.isna(v) else v for v in series]
+
+def test_classifiers_match_row_by_row():
+    rng = np.random.default_rng(4)
+    # every threshold, the values around it, then random ones
+    watched_by = pd.Series(np.concatenate([[0, 9999, 10000, 10001, 99999, 100000, 100001, 999999, 1000000, 1000001],
+                                           rng.integers(0, 3000000, 1000), [np.nan]]))
+    ltw_ratio = pd.Series(np.concatenate([[0, 0.1, 0.10001, 0.2, 0.20001, 0.4, 0.40001, 1], rng.random(1000)*0.6, [np.nan]]))
+    runtime = pd.Series(np.concatenate([[1, 29, 30, 59, 60, 89, 90, 119, 120, 149, 150, 179, 180, 181],
+                                        rng.integers(1, 240, 1000), [np.nan]])).astype('Int16')
+    # NaN fails every comparison of the if/elif chains and lands in the last bucket
+    assert engine.classify_popularity(watched_by).tolist() == [classify_popularity(v) for v in watched_by]
+    assert engine.classify_likeability(ltw_ratio).tolist() == [classify_likeability(v) for v in ltw_ratio]
+    assert as_list(engine.classify_runtime(runtime)) == as_list(classify_runtime(v) for v in runtime)
+
+def test_decade_year_matches_row_by_row():
+    year = pd.Series([1899, 1900, 1909, 1910, 1994, 1999, 2000, 2023, None, np.nan, 1994], index=np.arange(11)*2)
+    decade = engine.decade_year(year)
+    assert decade.index.equals(year.index)
+    assert as_list(decade) == [np.nan if pd.isna(v) else decade_year(v) for v in year]
+    assert list(decade.cat.categories) == ["1890s", "1900s", "1910s", "1990s", "2000s", "2020s"]
+    assert decade.cat.ordered
+    # years parsed from the film pages are strings
+    assert as_list(engine.decade_year(pd.Series(["1994", None, "2001"]))) == ["1990s", np.nan, "2000s"]
+
+def test_transform_ratings_matches_one_by_one():
+    stars = ["★", "★★", "★★★", "★★★★", "★★★★★", "½", "★½", "★★½", "★★★½", "★★★★½", "", "★★★★★★", "½★", "watched", None]
+    assert engine.transform_ratings(stars) == [transform_rating(v) for v in stars]
+    assert engine.transform_ratings(["", "★★★★★★", None]) == [-1, -1, -1]
@@ -0,0 +1,22 @@
+import os
+import pandas as pd
+import pytest
+import result_store
+
+def test_save_frames_replaces_the_snapshot(tmp_path):
+    path = str(tmp_path)
+    result_store.save_frames('day_a', {'film': pd.DataFrame({'id': [1, 2]}), 'actor': pd.DataFrame({'id': [1]})}, path=path)
+    assert result_store.load_frame('day_a', 'film', path=path)['id'].tolist() == [1, 2]
+    # run again, e.g. with --force, the frames of the first run are gone
+    result_store.save_frames('day_a', {'film': pd.DataFrame({'id': [3]})}, path=path)
+    assert result_store.load_frame('day_a', 'film', path=path)['id'].tolist() == [3]
+    assert sorted(os.listdir(result_store.snapshot_path('day_a', path))) == ['film.parquet']
+    assert os.listdir(path) == ['day_a']
+
+def test_save_frames_leaves_no_partial_snapshot(tmp_path):
+    path = str(tmp_path)
+    # the second frame can't be written, after the first one was
+    frames = {'film': pd.DataFrame({'id': [1]}), 'actor': pd.DataFrame({'id': [1, 'a']})}
+    with pytest.raises(Exception):
+        result_store.save_frames('day_a', frames, path=path)
+    assert os.listdir(path) == []